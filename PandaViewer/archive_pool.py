@@ -0,0 +1,155 @@
+import os
+import time
+from threading import RLock, Thread
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Tuple
+from .logger import Logger
+
+
+class ArchiveHandle(object):
+    """
+    An open archive shared between threads.
+    The lock has to be held for every operation on the archive since member reads share one file position.
+    """
+
+    def __init__(self, archive: Any, fp: Any = None):
+        self.lock = RLock()
+        self.archive = archive
+        self.fp = fp
+        self.closed = False
+        self.users = 0  # Threads that got the handle from the pool and haven't released it yet
+        self.last_used = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                close = getattr(self.archive, "close", None)  # unrar's RarFile has nothing to close
+                close and close()
+            finally:
+                self.fp and self.fp.close()
+
+
+class ArchivePool(Logger):
+    """
+    LRU pool of open archive handles keyed by (path, mtime_ns, size).
+    Reusing a handle skips reparsing the archive directory on every member access, a handle whose file
+    changed on disk is replaced on the next access, and at most MAX_OPEN_ARCHIVES are kept open at once.
+    Handles unused for IDLE_TIMEOUT seconds are closed, since Windows won't let other programs move or
+    delete a file while it's open.
+    """
+
+    MAX_OPEN_ARCHIVES = 32
+    IDLE_TIMEOUT = 2.0
+
+    def __init__(self):
+        self.lock = RLock()
+        self.handles = OrderedDict()  # type: OrderedDict[Tuple[str, int, int], ArchiveHandle]
+        self.path_keys = {}  # type: Dict[str, Tuple[str, int, int]]
+        self.reaper = None  # type: Thread
+
+    @contextmanager
+    def get(self, path: str, opener: Callable[[], Tuple[Any, Any]]):
+        """
+        Yields the open archive for path with its handle locked.
+        :param path: path of the archive on disk
+        :param opener: callable returning a newly opened (archive, file object or None) for path
+        """
+        while True:
+            handle = self.get_handle(path, opener)
+            try:
+                with handle.lock:
+                    if handle.closed:
+                        continue  # Evicted before we got to it
+                    yield handle.archive
+                    return
+            finally:
+                with self.lock:
+                    handle.users -= 1
+                    handle.last_used = time.monotonic()
+
+    def get_handle(self, path: str, opener: Callable[[], Tuple[Any, Any]]) -> ArchiveHandle:
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            handle = self.handles.get(key)
+            if handle is not None:
+                self.handles.move_to_end(key)
+                handle.users += 1
+                return handle
+        new_handle = ArchiveHandle(*opener())
+        stale = []
+        with self.lock:
+            handle = self.handles.get(key)
+            if handle is None:
+                handle = new_handle
+                new_handle = None
+                old_key = self.path_keys.get(path)
+                if old_key is not None:
+                    stale.append(self.handles.pop(old_key))
+                self.handles[key] = handle
+                self.path_keys[path] = key
+                while len(self.handles) > self.MAX_OPEN_ARCHIVES:
+                    old_key, old_handle = self.handles.popitem(last=False)
+                    del self.path_keys[old_key[0]]
+                    stale.append(old_handle)
+            else:
+                self.handles.move_to_end(key)
+            handle.users += 1
+            self.start_reaper()
+        if new_handle is not None:
+            stale.append(new_handle)  # Another thread opened the same archive first
+        self.close_handles(stale)
+        return handle
+
+    def start_reaper(self):
+        with self.lock:
+            if self.reaper is None:
+                self.reaper = Thread(target=self.close_idle_handles, daemon=True)
+                self.reaper.start()
+
+    def close_idle_handles(self):
+        while True:
+            time.sleep(self.IDLE_TIMEOUT / 2)
+            deadline = time.monotonic() - self.IDLE_TIMEOUT
+            with self.lock:
+                idle = [key for key, handle in self.handles.items()
+                        if not handle.users and handle.last_used < deadline]
+                stale = [self.handles.pop(key) for key in idle]
+                for key in idle:
+                    del self.path_keys[key[0]]
+                done = not self.handles
+                if done:
+                    self.reaper = None
+            self.close_handles(stale)
+            if done:
+                return
+
+    def evict(self, path: str):
+        """
+        Closes the handle for the given path, should be called before the archive is moved or deleted.
+        """
+        with self.lock:
+            key = self.path_keys.pop(path, None)
+            handle = key and self.handles.pop(key)
+        handle and self.close_handles([handle])
+
+    def close_all(self):
+        with self.lock:
+            handles = list(self.handles.values())
+            self.handles.clear()
+            self.path_keys.clear()
+        self.close_handles(handles)
+
+    def close_handles(self, handles):
+        for handle in handles:
+            try:
+                handle.close()
+            except Exception:
+                self.logger.warning("Failed to close archive handle", exc_info=True)
+
+
+archive_pool = ArchivePool()
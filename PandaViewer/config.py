@@ -18,12 +18,18 @@ class Config(Logger, SafeConfigParser):
             "sort_type",
             "sort_mode_reversed",
             "confirm_delete",
+            "incremental_scan",
+            "event_quiet_window",
+            "database_profile",
+            "thumbnail_backend",
         ],
         "Archives": [
             "extract_zip",
             "extract_cbz",
             "extract_rar",
             "extract_cbr",
+            "prefetch_pages",
+            "extraction_cache_size",
         ],
         "Ex": [
             "ex_member_id",
@@ -34,6 +40,9 @@ class Config(Logger, SafeConfigParser):
     FOLDER_OPTIONS = [
         AUTO_METADATA_KEY,
     ]
+    _folders = None
+    _folder_prefixes = ()
+    folders_version = 0
 
 
     def __init__(self):
@@ -56,6 +65,11 @@ class Config(Logger, SafeConfigParser):
     def load(self):
         with codecs.open(self.CONFIG_FILE, "r", encoding="utf8") as file:
             self.read_file(file)
+        self.invalidate_folders()
+
+    def invalidate_folders(self):
+        self._folders = None
+        self.folders_version += 1
 
     def save(self):
         self.logger.debug("Saving config")
@@ -97,12 +111,29 @@ class Config(Logger, SafeConfigParser):
 
     @property
     def folders(self):
-        folders = self.get("General", "folders") or "[]"
-        return list(map(Utils.normalize_path, json.loads(folders)))
+        """
+        Parsed and normalized once, then cached until the setting changes.
+        """
+        if self._folders is None:
+            folders = self.get("General", "folders") or "[]"
+            folders = tuple(map(Utils.normalize_path, json.loads(folders)))
+            self._folder_prefixes = tuple(map(Utils.ensure_trailing_sep, folders))
+            self._folders = folders
+        return list(self._folders)
 
     @folders.setter
     def folders(self, value):
         self.set("General", "folders", json.dumps(value, ensure_ascii=False))
+        self.invalidate_folders()
+
+    @property
+    def folder_prefixes(self):
+        """
+        Normalized folders with a trailing separator, for prefix checks against already normalized paths.
+        """
+        if self._folders is None:
+            self.folders  # Parses and caches the folders along with their prefixes
+        return self._folder_prefixes
 
     @property
     def folder_options(self):
@@ -162,6 +193,47 @@ class Config(Logger, SafeConfigParser):
     def confirm_delete(self, value):
         self.set("General", "confirm_delete", str(value))
 
+    @property
+    def incremental_scan(self):
+        try:
+            return self.getboolean("General", "incremental_scan")
+        except ValueError:
+            return True
+
+    @incremental_scan.setter
+    def incremental_scan(self, value):
+        self.set("General", "incremental_scan", str(value))
+
+    @property
+    def event_quiet_window(self):
+        try:
+            return self.getfloat("General", "event_quiet_window")
+        except ValueError:
+            return 1.0
+
+    @event_quiet_window.setter
+    def event_quiet_window(self, value):
+        self.set("General", "event_quiet_window", str(value))
+
+    @property
+    def database_profile(self):
+        return self.get("General", "database_profile") or "performance"
+
+    @database_profile.setter
+    def database_profile(self, value):
+        self.set("General", "database_profile", value)
+
+    @property
+    def thumbnail_backend(self):
+        """
+        "threads" or "processes", the latter generates thumbnails in a process pool with one process per core.
+        """
+        return self.get("General", "thumbnail_backend") or "threads"
+
+    @thumbnail_backend.setter
+    def thumbnail_backend(self, value):
+        self.set("General", "thumbnail_backend", value)
+
     @property
     def extract_zip(self):
         try:
@@ -206,5 +278,30 @@ class Config(Logger, SafeConfigParser):
     def extract_cbr(self, value):
         self.set("Archives", "extract_cbr", str(value))
 
+    @property
+    def prefetch_pages(self):
+        try:
+            return self.getint("Archives", "prefetch_pages")
+        except ValueError:
+            return 10
+
+    @prefetch_pages.setter
+    def prefetch_pages(self, value):
+        self.set("Archives", "prefetch_pages", str(value))
+
+    @property
+    def extraction_cache_size(self):
+        """
+        Size limit of the extraction cache in MiB.
+        """
+        try:
+            return self.getint("Archives", "extraction_cache_size")
+        except ValueError:
+            return 2048
+
+    @extraction_cache_size.setter
+    def extraction_cache_size(self, value):
+        self.set("Archives", "extraction_cache_size", str(value))
+
 
 Config = Config()
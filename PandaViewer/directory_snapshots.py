@@ -0,0 +1,87 @@
+import json
+import hashlib
+from threading import RLock
+from collections import namedtuple
+from typing import Dict, List, Optional
+from sqlalchemy import select, delete, insert
+from PandaViewer import user_database
+from .logger import Logger
+
+
+Snapshot = namedtuple("Snapshot", "mtime_ns entry_count digest subdirectories")
+
+
+class DirectorySnapshots(Logger):
+    """
+    Stores the state of every scanned directory so rescans can skip directories that haven't changed.
+    A snapshot records the directory's mtime, its entry count, a digest of its listing and the
+    names of its subdirectories so unchanged directories can be walked without being listed again.
+    """
+
+    CHUNK_SIZE = 500
+
+    def __init__(self):
+        self.lock = RLock()
+        self.snapshots = None  # type: Dict[str, Snapshot]
+
+    @staticmethod
+    def create_snapshot(mtime_ns: int, names: List[str], subdirectories: List[str]) -> Snapshot:
+        digest = hashlib.sha1("\0".join(sorted(names)).encode("utf8", "surrogateescape")).hexdigest()
+        return Snapshot(mtime_ns, len(names), digest, subdirectories)
+
+    @staticmethod
+    def same_listing(first: Snapshot, second: Snapshot) -> bool:
+        return first.entry_count == second.entry_count and first.digest == second.digest
+
+    def load(self):
+        with self.lock:
+            if self.snapshots is not None:
+                return
+            self.logger.debug("Loading directory snapshots from database.")
+            with user_database.get_session(self) as session:
+                rows = session.execute(select([user_database.DirectorySnapshot])).fetchall()
+            self.snapshots = {row["path"]: Snapshot(row["mtime_ns"], row["entry_count"], row["digest"],
+                                                    json.loads(row["subdirectories"]))
+                              for row in rows}
+            self.logger.debug("Loaded %s directory snapshots." % len(self.snapshots))
+
+    def get(self, path: str) -> Optional[Snapshot]:
+        self.load()
+        with self.lock:
+            return self.snapshots.get(path)
+
+    def update(self, snapshots: Dict[str, Snapshot]):
+        if not snapshots:
+            return
+        self.load()
+        with self.lock:
+            self.snapshots.update(snapshots)
+        self.logger.debug("Saving %s directory snapshots." % len(snapshots))
+        paths = list(snapshots)
+        with user_database.get_session(self, acquire=True) as session:
+            for i in range(0, len(paths), self.CHUNK_SIZE):
+                session.execute(delete(user_database.DirectorySnapshot).where(
+                    user_database.DirectorySnapshot.path.in_(paths[i:i + self.CHUNK_SIZE])))
+            session.execute(insert(user_database.DirectorySnapshot), [
+                {
+                    "path": path,
+                    "mtime_ns": snapshot.mtime_ns,
+                    "entry_count": snapshot.entry_count,
+                    "digest": snapshot.digest,
+                    "subdirectories": json.dumps(snapshot.subdirectories),
+                } for path, snapshot in snapshots.items()
+            ])
+
+    def invalidate(self, path: str):
+        """
+        Forces the next incremental scan to list the given directory again.
+        """
+        self.load()
+        with self.lock:
+            if self.snapshots.pop(path, None) is None:
+                return
+        with user_database.get_session(self, acquire=True) as session:
+            session.execute(delete(user_database.DirectorySnapshot).where(
+                user_database.DirectorySnapshot.path == path))
+
+directory_snapshots = DirectorySnapshots()
@@ -0,0 +1,127 @@
+import os
+import queue
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List
+from .utils import Utils
+from .logger import Logger
+from .directory_snapshots import directory_snapshots, Snapshot
+from .gallery import FolderGallery, ZipGallery, RarGallery, GalleryIDMap
+
+
+class DirectoryWalker(Logger):
+    """
+    Walks through folders with os.scandir on a pool of threads and yields gallery candidates
+    as soon as the directory containing them has been scanned.
+    When incremental is set, directories that are unchanged since their last snapshot are not listed again.
+    """
+
+    THREAD_COUNT = 8
+    IMAGE_EXTS = frozenset(FolderGallery.IMAGE_EXTS)
+    ZIP_EXTS = frozenset(ZipGallery.ARCHIVE_EXTS)
+    RAR_EXTS = frozenset(RarGallery.ARCHIVE_EXTS)
+
+    def __init__(self, incremental: bool = True, on_directory: Callable[[str], None] = None):
+        self.incremental = incremental
+        self.on_directory = on_directory
+        self.snapshots = {}  # type: Dict[str, Snapshot]
+        self.lock = Lock()
+        self.pending = 0
+        self.results = None  # type: queue.Queue
+        self.executor = None  # type: ThreadPoolExecutor
+
+    @staticmethod
+    def get_extension(name: str) -> str:
+        index = name.rfind(".")
+        return name[index:].lower() if index > 0 else ""
+
+    def walk(self, folders: List[str]) -> Iterator[Dict]:
+        if not folders:
+            return
+        self.results = queue.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=self.THREAD_COUNT)
+        try:
+            # Held until every root is submitted so a root finishing early doesn't end the walk
+            with self.lock:
+                self.pending += 1
+            try:
+                for folder in folders:
+                    self.submit(Utils.normalize_path(folder))
+            finally:
+                self.release()
+            while True:
+                candidate = self.results.get()
+                if candidate is None:
+                    break
+                yield candidate
+        finally:
+            self.executor.shutdown(wait=False)
+        self.logger.info("Done walking %s folders, %s directories listed." % (len(folders), len(self.snapshots)))
+
+    def submit(self, directory: str):
+        with self.lock:
+            self.pending += 1
+        self.executor.submit(self.scan, directory)
+
+    def scan(self, directory: str):
+        try:
+            self.scan_directory(directory)
+        except Exception:
+            self.logger.warning("Failed to scan %s" % directory, exc_info=True)
+        finally:
+            self.release()
+
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+            done = self.pending == 0
+        if done:
+            self.results.put(None)
+
+    def scan_directory(self, directory: str):
+        if self.on_directory:
+            self.on_directory(directory)
+        mtime_ns = os.stat(directory).st_mtime_ns
+        old_snapshot = directory_snapshots.get(directory)
+        if self.incremental and old_snapshot and old_snapshot.mtime_ns == mtime_ns:
+            for subdirectory in old_snapshot.subdirectories:
+                self.submit(os.path.join(directory, subdirectory))
+            return
+        names = []
+        images = []
+        subdirectories = []
+        candidates = []
+        for entry in os.scandir(directory):
+            names.append(entry.name)
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if is_dir:
+                if not entry.is_symlink():  # Same as os.walk, don't follow symlinked folders
+                    subdirectories.append(entry.name)
+                continue
+            ext = self.get_extension(entry.name)
+            if ext in self.IMAGE_EXTS:
+                images.append(entry.path)
+            elif ext in self.ZIP_EXTS or ext in self.RAR_EXTS:
+                type = GalleryIDMap.ZipGallery if ext in self.ZIP_EXTS else GalleryIDMap.RarGallery
+                path = Utils.normalize_path(entry.path) if entry.is_symlink() else entry.path
+                candidates.append({"path": path, "type": type.value, "normalized": True})
+        if images:
+            candidates.append(
+                {
+                    "path": directory,
+                    "type": GalleryIDMap.FolderGallery.value,
+                    "files": sorted(images, key=lambda f: f.lower()),
+                    "normalized": True,
+                })
+        snapshot = directory_snapshots.create_snapshot(mtime_ns, names, subdirectories)
+        with self.lock:
+            self.snapshots[directory] = snapshot
+        for subdirectory in subdirectories:
+            self.submit(os.path.join(directory, subdirectory))
+        if self.incremental and old_snapshot and directory_snapshots.same_listing(old_snapshot, snapshot):
+            return
+        for candidate in candidates:
+            self.results.put(candidate)
@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import shutil
+from threading import RLock
+from collections import OrderedDict, Counter
+from contextlib import contextmanager
+from typing import Dict, List
+from .utils import Utils
+from .logger import Logger
+from .config import Config
+
+
+class ExtractionCache(Logger):
+    """
+    Shared directory for files extracted from archives, reused across sessions.
+    Every archive extracts into a subdirectory named after its cache key, and index.json records the
+    extracted members and their total size per key in least recently used order.
+    Once the total size goes over Config.extraction_cache_size the least recently used extractions
+    are deleted, extractions in progress are never deleted.
+    index.json is written after evictions, at most every SAVE_INTERVAL seconds otherwise, and on shutdown.
+    """
+
+    CACHE_DIR = Utils.convert_from_relative_lsv_path("extracted")
+    INDEX_FILE = os.path.join(CACHE_DIR, "index.json")
+    SAVE_INTERVAL = 30
+
+    def __init__(self):
+        self.lock = RLock()
+        self.entries = None  # type: OrderedDict[str, Dict]
+        self.pinned = Counter()
+        self.dirty = False
+        self.last_save = time.monotonic()
+
+    def load(self):
+        with self.lock:
+            if self.entries is not None:
+                return
+            self.entries = OrderedDict()
+            os.makedirs(self.CACHE_DIR, exist_ok=True)
+            try:
+                with open(self.INDEX_FILE, "r", encoding="utf8") as index_file:
+                    entries = json.load(index_file, object_pairs_hook=OrderedDict)
+            except FileNotFoundError:
+                entries = OrderedDict()
+            except (OSError, ValueError):
+                self.logger.warning("Failed to read extraction cache index, starting empty", exc_info=True)
+                entries = OrderedDict()
+            for key, entry in entries.items():
+                if os.path.isdir(self.get_path(key)):
+                    self.entries[key] = entry
+            for name in os.listdir(self.CACHE_DIR):
+                path = os.path.join(self.CACHE_DIR, name)
+                if name not in self.entries and os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)  # Left behind by a crash or a failed eviction
+            self.dirty = len(self.entries) != len(entries)
+            self.logger.debug("Loaded %s extraction cache entries." % len(self.entries))
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            temp_file = self.INDEX_FILE + ".tmp"
+            with open(temp_file, "w", encoding="utf8") as index_file:
+                json.dump(self.entries, index_file)
+            os.replace(temp_file, self.INDEX_FILE)
+            self.dirty = False
+            self.last_save = time.monotonic()
+
+    def get_path(self, key: str) -> str:
+        return Utils.normalize_path(os.path.join(self.CACHE_DIR, key))
+
+    @contextmanager
+    def use(self, key: str):
+        """
+        Yields the directory for the given key, which won't be evicted until the context exits.
+        """
+        self.load()
+        path = self.get_path(key)
+        with self.lock:
+            self.pinned[key] += 1
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.dirty = True
+        try:
+            os.makedirs(path, exist_ok=True)
+            yield path
+        finally:
+            with self.lock:
+                self.pinned[key] -= 1
+                if not self.pinned[key]:
+                    del self.pinned[key]
+
+    def has_files(self, key: str, members: List[str]) -> bool:
+        self.load()
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and all(m in entry["files"] for m in members)
+
+    def add_files(self, key: str, members: List[str]):
+        """
+        Records members that were just extracted into the directory for key and evicts old extractions
+        if that took the cache over its budget.
+        """
+        self.load()
+        path = self.get_path(key)
+        with self.lock:
+            entry = self.entries.setdefault(key, {"size": 0, "files": {}})
+            self.entries.move_to_end(key)
+            for member in members:
+                if member in entry["files"]:
+                    continue
+                try:
+                    size = os.path.getsize(os.path.join(path, member))
+                except OSError:
+                    size = 0
+                entry["files"][member] = size
+                entry["size"] += size
+            self.dirty = True
+            if self.evict_over_budget() or time.monotonic() - self.last_save >= self.SAVE_INTERVAL:
+                self.save()
+
+    def evict_over_budget(self) -> bool:
+        """
+        :return: whether anything was evicted
+        """
+        evicted = False
+        with self.lock:
+            budget = Config.extraction_cache_size * 1024 * 1024
+            total = sum(entry["size"] for entry in self.entries.values())
+            for key in list(self.entries):
+                if total <= budget:
+                    break
+                if key in self.pinned:
+                    continue
+                total -= self.entries.pop(key)["size"]
+                self.dirty = evicted = True
+                shutil.rmtree(self.get_path(key), ignore_errors=True)
+                self.logger.debug("Evicted extraction %s" % key)
+        return evicted
+
+
+extraction_cache = ExtractionCache()
@@ -1,8 +1,8 @@
+import io
 import os
 import json
 import shutil
 import hashlib
-import tempfile
 import humanize
 import subprocess
 from time import time
@@ -18,7 +18,11 @@ from contextlib import contextmanager
 from PyQt5 import QtGui, QtCore, QtQml
 from sqlalchemy import select, update, insert, delete
 import PandaViewer
-from . import zipfile, metadata, exceptions, user_database
+from . import zipfile, metadata, exceptions, user_database, thumbnails
+from .hash_cache import hash_cache
+from .archive_pool import archive_pool
+from .extraction_cache import extraction_cache
+from .image_provider import ArchiveImageProvider
 from .utils import Utils
 from .logger import Logger
 from .config import Config
@@ -32,8 +36,7 @@ class GalleryIDMap(Enum):
 
 class GenericGallery(Logger):
     IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".gif")
-    IMAGE_WIDTH = 200
-    IMAGE_HEIGHT = 280
+    IMAGE_EXT_SET = frozenset(IMAGE_EXTS)
     MAX_TOOLTIP_LENGTH = 80
     FILTERED_FILES = ("hentairulesbanner", "credits", "recruit", "zcredits", "kameden", "!credits")
     thumbnail_source = None
@@ -55,6 +58,8 @@ class GenericGallery(Logger):
     db_uuid_verified = False
     metadata_manager = None
     release_called = False
+    json_cache = None
+    tag_tooltip = None
     lock = RLock()
 
     def __repr__(self):
@@ -82,18 +87,18 @@ class GenericGallery(Logger):
 
     @classmethod
     def generate_hash_from_file(cls, file_path: str) -> str:
-        with open(file_path, "rb") as f:
-            return Utils.generate_hash_from_source(f)
+        def generate_hash():
+            with open(file_path, "rb") as f:
+                return Utils.generate_hash_from_source(f)
+        return hash_cache.get_hash(file_path, generate_hash)
 
     @classmethod
-    def get_image_from_file(self, file_path: str) -> QtGui.QImage:
+    def get_image_from_file(cls, file_path: str, scale=None) -> QtGui.QImage:
         assert os.path.exists(file_path)
-        image = QtGui.QImageReader()
-        image.setDecideFormatFromContent(True)  # Required for cases when the extension doesn't match the content
-        image.setFileName(file_path)
-        image = image.read()
-        assert image.width()
-        return image
+        reader = QtGui.QImageReader()
+        reader.setDecideFormatFromContent(True)  # Required for cases when the extension doesn't match the content
+        reader.setFileName(file_path)
+        return thumbnails.read_image(reader, scale)
 
     @classmethod
     def filtered_files(cls, files: List[str]) -> List[str]:
@@ -117,31 +122,68 @@ class GenericGallery(Logger):
                 self.force_metadata = True
                 self.get_metadata()
         self.save_metadata(update_ui=True)
-        PandaViewer.app.setup_tags()
+        PandaViewer.app.update_gallery_indexes(self)
+
+    JSON_KEYS = ("title", "rating", "tooltip", "dbUUID", "category", "galleryHasMetadata", "image")
 
     def get_json(self) -> Dict:
-        return {
-            "title": self.title,
-            "rating": self.metadata_manager.get_value("rating"),
-            "tooltip": self.get_tooltip(),
-            "dbUUID": self.ui_uuid,
-            "category": self.metadata_manager.get_value("category"),
-            "galleryHasMetadata": self.metadata_manager.get_metadata_value(
-                metadata.MetadataClassMap.gmetadata, "url") != "", # TODO fix for future sites
-            "image": Utils.convert_to_qml_path(self.thumbnail_path),
-        }
+        return {key: self.get_json_value(key) for key in self.JSON_KEYS}
+
+    def get_json_value(self, key: str):
+        """
+        Returns a single entry of get_json, used by the gallery model to only build the roles QML asks for.
+        Values are cached until invalidate_json is called.
+        """
+        if key == "tooltip":  # Has a relative read time, only its tag table is cached
+            return self.get_tooltip()
+        json_cache = self.json_cache
+        if json_cache is None:
+            json_cache = self.json_cache = {}
+        if key not in json_cache:
+            json_cache[key] = self.create_json_value(key)
+        return json_cache[key]
+
+    def create_json_value(self, key: str):
+        if key == "title":
+            return self.title
+        elif key == "rating":
+            return self.metadata_manager.get_value("rating")
+        elif key == "dbUUID":
+            return self.ui_uuid
+        elif key == "category":
+            return self.metadata_manager.get_value("category")
+        elif key == "galleryHasMetadata":
+            return self.metadata_manager.get_metadata_value(
+                metadata.MetadataClassMap.gmetadata, "url") != ""  # TODO fix for future sites
+        elif key == "image":
+            return Utils.convert_to_qml_path(self.thumbnail_path)
+        raise KeyError(key)
 
     def get_detailed_json(self) -> Dict:
         gallery_json = self.get_json()
-        gallery_json["files"] = self.get_files()
+        gallery_json["files"] = self.get_file_urls()
         gallery_json["metadata"] = self.metadata_manager.get_customize_json()
         return gallery_json
 
+    def invalidate_json(self):
+        """
+        Drops the cached UI values, needs to be called whenever metadata, read stats, location or thumbnail change.
+        """
+        self.json_cache = None
+        self.tag_tooltip = None
+
     def get_tooltip(self) -> str:
         plural = "s" if self.read_count != 1 else ""
         tooltip = "Read %s time%s" % (self.read_count, plural)
         if self.last_read:
             tooltip += "<br>Last read %s" % self.local_last_read_time
+        tag_tooltip = self.tag_tooltip
+        if tag_tooltip is None:
+            tag_tooltip = self.tag_tooltip = self.create_tag_tooltip()
+        return tooltip + tag_tooltip
+
+    def create_tag_tooltip(self) -> str:
+        tag_tooltip = ""
         tag_map = {}
         for tag in self.metadata_manager.all_tags:
             tag, namespace = Utils.separate_tag(tag)
@@ -168,8 +210,7 @@ class GenericGallery(Logger):
                     tag_tooltip = tag_tooltip[:-2]
                 tag_tooltip += "</td></tr>"
             tag_tooltip += "</table>"
-            tooltip += tag_tooltip
-        return tooltip
+        return tag_tooltip
 
     def set_rating(self, rating: float):
         rating = str(rating)
@@ -178,6 +219,7 @@ class GenericGallery(Logger):
         self.metadata_manager.update_metadata_value(metadata.MetadataClassMap.cmetadata,
                                                     "rating", rating)
         self.metadata_manager.save(metadata.MetadataClassMap.cmetadata)
+        PandaViewer.app.update_gallery_indexes(self)
         self.update_ui_gallery()
 
     def find_in_db(self):
@@ -225,6 +267,7 @@ class GenericGallery(Logger):
 
     def delete_from_db(self):
         self.logger.debug("Deleting from db.")
+        hash_cache.forget(self.hashed_files)
         self.metadata_manager.delete_all()
         with user_database.get_session(self) as session:
             session.execute(delete(user_database.Gallery).where(user_database.Gallery.id == self.db_id))
@@ -264,21 +307,30 @@ class GenericGallery(Logger):
             self.metadata_manager.update_metadata(metadata.MetadataClassMap[name], values)
         self.force_metadata = False
 
-    def save_metadata(self, update_ui: bool = True):
+    def save_metadata(self, update_ui: bool = True, session=None):
+        """
+        Saves the gallery row and all of its metadata in a single transaction.
+        :param session: session of an ongoing transaction to save in, see unit_of_work for batching saves
+        """
+        if session is None:
+            with user_database.get_session(self, acquire=True) as session:
+                self.save_metadata(update_ui=False, session=session)
+            if update_ui:
+                self.update_ui_gallery()
+            return
         self.logger.info("Saving gallery metadata")
-        self.metadata_manager.save_all()
-        with user_database.get_session(self) as session:
-            session.execute(update(user_database.Gallery).where(user_database.Gallery.id == self.db_id).values(
-                {
-                    "image_hash": self.image_hash,
-                    "read_count": self.read_count,
-                    "last_read": self.last_read,
-                    "path": self.location,
-                    "uuid": self.db_uuid,
-                    "mtime_hash": self.mtime_hash,
-                    "thumbnail_source": self.thumbnail_source,
-                }
-            ))
+        self.metadata_manager.save_all(session=session)
+        session.execute(update(user_database.Gallery).where(user_database.Gallery.id == self.db_id).values(
+            {
+                "image_hash": self.image_hash,
+                "read_count": self.read_count,
+                "last_read": self.last_read,
+                "path": self.location,
+                "uuid": self.db_uuid,
+                "mtime_hash": self.mtime_hash,
+                "thumbnail_source": self.thumbnail_source,
+            }
+        ))
         self.logger.info("Gallery metadata saved")
         if update_ui:
             self.update_ui_gallery()
@@ -288,15 +340,24 @@ class GenericGallery(Logger):
 
     def resize_thumbnail_source(self) -> QtGui.QImage:
         try:
-            image = self.get_image(index=int(self.thumbnail_source))
+            image = self.get_image(index=int(self.thumbnail_source), scale=thumbnails.get_thumbnail_size)
         except (ValueError, TypeError):
-            image = self.get_image_from_file(self.thumbnail_source)
-        if image.width() > image.height():
-            transform = QtGui.QTransform()
-            transform.rotate(-90)
-            image = image.transformed(transform)
-        return image.scaled(self.IMAGE_WIDTH, self.IMAGE_HEIGHT,
-                            QtCore.Qt.KeepAspectRatioByExpanding, QtCore.Qt.SmoothTransformation)
+            image = self.get_image_from_file(self.thumbnail_source, scale=thumbnails.get_thumbnail_size)
+        return thumbnails.scale_thumbnail(image)
+
+    def get_thumbnail_job(self) -> thumbnails.ThumbnailJob:
+        """
+        Describes the thumbnail source for the thumbnail process pool, along with its cached hash if any.
+        """
+        try:
+            path, member, archive_format = self.get_image_source(index=int(self.thumbnail_source))
+        except (ValueError, TypeError):
+            if not os.path.exists(self.thumbnail_source):  # Same fallback as validate_thumbnail_source
+                self.thumbnail_source = str(0)
+                return self.get_thumbnail_job()
+            path, member, archive_format = self.thumbnail_source, "", None
+        return thumbnails.ThumbnailJob(path, member, archive_format, PandaViewer.app.THUMB_DIR,
+                                       hash_cache.get_cached_hash(path, member))
 
     def generate_thumbnail(self):
         try:
@@ -346,6 +407,7 @@ class GenericGallery(Logger):
         self.read_count += 1
         self.last_read = int(time())
         self.save_metadata()
+        PandaViewer.app.update_gallery_indexes(self)
         self.open_file(index)
 
     def open_file(self, index=0):
@@ -404,6 +466,7 @@ class GenericGallery(Logger):
 
     def gallery_deleted(self):
         self.expired = True
+        hash_cache.forget(self.hashed_files)
         with user_database.get_session(self) as session:
             session.execute(update(user_database.Gallery).where(
                 user_database.Gallery.id == self.db_id).values({
@@ -413,10 +476,23 @@ class GenericGallery(Logger):
     def get_file_size(self):
         raise NotImplementedError
 
+    @property
+    def hashed_files(self) -> List[str]:
+        """
+        Files the hash cache can have entries for, they're dropped once the gallery is deleted.
+        """
+        raise NotImplementedError
+
     def find_file_index(self, path):
         raise NotImplementedError
 
-    def get_image(self, index=None):
+    def get_image(self, index=None, scale=None):
+        raise NotImplementedError
+
+    def get_image_source(self, index=None) -> Tuple[str, str, str]:
+        """
+        Returns the (path, archive member, archive format) the image at index is read from.
+        """
         raise NotImplementedError
 
     def generate_image_hash(self, index=None):
@@ -434,7 +510,7 @@ class GenericGallery(Logger):
     def file_belongs_to_gallery(self, file):
         raise NotImplementedError
 
-    def file_moved(self, destination):
+    def file_moved(self, destination, refresh=True):
         raise NotImplementedError
 
     def file_deleted(self):
@@ -449,6 +525,9 @@ class GenericGallery(Logger):
     def find_files(self, find_all=False) -> List[str]:
         raise NotImplementedError
 
+    def get_file_urls(self) -> List[str]:
+        return [QtCore.QUrl.fromLocalFile(f).toString(QtCore.QUrl.FullyEncoded) for f in self.get_files()]
+
     @property
     def image_folder(self) -> str:
         return Utils.convert_to_qml_path(os.path.dirname(self.get_files()[0]))
@@ -521,11 +600,19 @@ class FolderGallery(GenericGallery):
         else:
             return self._files
 
+    @property
+    def hashed_files(self) -> List[str]:
+        return list(self._files or [])  # Not listed again, the folder may already be gone
+
     def validate_file_count(self):
         assert len(self.get_files()) > 0
 
-    def get_image(self, index=None):
-        return self.get_image_from_file(self.get_files()[index])
+    def get_image(self, index=None, scale=None):
+        return self.get_image_from_file(self.get_files()[index], scale)
+
+    def get_image_source(self, index=None):
+        index = index if index is not None else 0
+        return self.get_files()[index], "", None
 
     def generate_image_hash(self, index=None):
         index = index if index is not None else 0
@@ -533,12 +620,14 @@ class FolderGallery(GenericGallery):
 
     def find_files(self, find_all=False) -> List[str]:
         found_files = []
-        for base_folder, _, files in os.walk(self.folder):
-            for f in files:
-                if Utils.file_has_allowed_extension(f, self.IMAGE_EXTS) or find_all:
-                    found_files.append(os.path.join(base_folder, f))
-            break
-        found_files = list(map(os.path.normpath, found_files))
+        for entry in os.scandir(self.folder):
+            try:
+                if entry.is_dir():
+                    continue
+            except OSError:
+                pass
+            if find_all or os.path.splitext(entry.name)[-1].lower() in self.IMAGE_EXT_SET:
+                found_files.append(os.path.normpath(entry.path))
         return Utils.human_sort_paths(found_files)
 
     def delete_file(self):
@@ -585,7 +674,9 @@ class FolderGallery(GenericGallery):
                 self.reset_filesystem_data()
                 return False
 
-    def file_moved(self, destination):
+    def file_moved(self, destination, refresh=True):
+        if not refresh:
+            return
         with self.lock:
             self.reset_files()
             self.reset_filesystem_data()
@@ -615,7 +706,7 @@ class FolderGallery(GenericGallery):
 
 class ArchiveGallery(GenericGallery):
     ARCHIVE_EXTS = ()
-    temp_dir = None
+    ARCHIVE_FORMAT = None
     archive_type = None
     archive_file = None
     _raw_files = None
@@ -624,16 +715,10 @@ class ArchiveGallery(GenericGallery):
         self.change_archive_file(kwargs.get("path"))
         super().__init__(**kwargs)
 
-    def __del__(self):
-        super().__del__()
-        if self.temp_dir:
-            try:
-                shutil.rmtree(self.temp_dir)
-            except Exception:
-                self.logger.warning("Failed to delete tempdir", exc_info=True)
-
     def change_archive_file(self, file):
         with self.lock:
+            if self.archive_file is not None:
+                archive_pool.evict(self.archive_file)
             self.archive_file = Utils.normalize_path(file)
             self.folder = os.path.dirname(self.archive_file)
             self.name, self.archive_type = os.path.splitext(os.path.basename(self.archive_file))
@@ -656,44 +741,113 @@ class ArchiveGallery(GenericGallery):
     def file_count(self):
         return len(self.get_raw_files())
 
+    @property
+    def hashed_files(self) -> List[str]:
+        return [self.archive_file]
+
     @property
     def sort_path(self):
         return self.archive_file
 
     @property
+    @contextmanager
     def archive(self):
+        try:
+            with archive_pool.get(self.archive_file, self.open_archive) as archive:
+                yield archive
+        except Exception:
+            self.logger.error("Failed to complete archive op for %s" % self.archive_file, exc_info=True)
+            raise exceptions.UnknownArchiveError()
+
+    def open_archive(self):
+        """
+        Opens the archive file, returning the archive and the file object it reads from, if any.
+        """
         raise NotImplementedError
 
-    def get_image(self, index=None):
-        image = QtGui.QImage()
-        assert image.loadFromData(self.get_raw_image(index=index).read())
-        return image
+    def get_image(self, index=None, scale=None):
+        return thumbnails.read_image_from_data(self.get_raw_image(index=index).read(), scale)
+
+    def get_image_source(self, index=None):
+        index = index if index is not None else 0
+        return self.archive_file, self.get_raw_files()[index], self.ARCHIVE_FORMAT
 
     def open_file(self, index=0):
         if getattr(Config, "extract_" + self.archive_type.lower()) or index != 0:
-            super().open_file(index)
+            with extraction_cache.use(self.extraction_key):  # Can't be evicted before the viewer opens it
+                self.extract_files([index])
+                super().open_file(index)
+            PandaViewer.app.prefetch_gallery_files(self, index + 1)
         else:
             QtGui.QDesktopServices.openUrl(QtCore.QUrl.fromLocalFile(self.archive_file))
 
+    def prefetch_files(self, index=0):
+        """
+        Extracts the Config.prefetch_pages files from index on in the background after a page was opened
+        in an external viewer, so the next pages are already on disk when the viewer gets to them.
+        """
+        members = self.get_raw_files()[index:index + Config.prefetch_pages]
+        if members:
+            self.extract_members(members)
+
+    @property
+    def extraction_key(self) -> str:
+        """
+        Key of the archive in the extraction cache, changes whenever the archive file does.
+        """
+        return hashlib.sha1(((self.db_uuid or self.archive_file) +
+                             self.generate_mtime_hash()).encode("utf8")).hexdigest()
+
+    def extract_files(self, indexes: List[int]):
+        """
+        Extracts the given files to the extraction cache, skipping the ones that are already there.
+        :param indexes: indexes into the filtered file list
+        """
+        raw_files = self.get_raw_files()
+        self.extract_members([raw_files[i] for i in indexes])
+
     def extract(self):
-        if not self.temp_dir:
-            self.temp_dir = Utils.normalize_path(tempfile.mkdtemp())
+        self.extract_members(self.get_raw_files(filtered=False))
+
+    def extract_members(self, members: List[str]):
+        key = self.extraction_key
+        # Entered on cache hits too, so they count as a use for the LRU order
+        with extraction_cache.use(key) as extraction_dir:
+            if extraction_cache.has_files(key, members):
+                return
             with self.archive as archive:
-                archive.extractall(self.temp_dir)
+                members = [m for m in members if not extraction_cache.has_files(key, [m])]
+                for member in members:
+                    archive.extract(member, extraction_dir)
+                extraction_cache.add_files(key, members)
+
+    @property
+    def image_folder(self) -> str:
+        # The thumbnail dialog browses the folder, so it needs every file on disk
+        self.extract()
+        return super().image_folder
 
     def get_file_size(self):
         return os.path.getsize(self.archive_file)
 
     def get_raw_image(self, index=None):
         index = index if index is not None else 0
+        member = self.get_raw_files()[index]
         with self.archive as archive:
-            return archive.open(self.get_raw_files()[index])
+            return io.BytesIO(archive.read(member))
 
     def get_files(self, filtered=True):
-        self.extract()
-        files = [os.path.join(self.temp_dir, f) for f in self.get_raw_files(filtered=filtered)]
+        """
+        Paths the files have in the extraction cache, they're only on disk after extract_files or extract.
+        """
+        extraction_dir = extraction_cache.get_path(self.extraction_key)
+        files = [os.path.join(extraction_dir, f) for f in self.get_raw_files(filtered=filtered)]
         return self.filtered_files(list(map(Utils.normalize_path, files)))
 
+    def get_file_urls(self) -> List[str]:
+        return ["image://%s/%s/%s" % (ArchiveImageProvider.NAME, self.ui_uuid, i)
+                for i in range(len(self.get_raw_files()))]
+
     def find_files(self, find_all=False) -> List[str]:
         with self.archive as archive:
             raw_files = [f for f in archive.namelist()
@@ -701,10 +855,15 @@ class ArchiveGallery(GenericGallery):
         return Utils.human_sort_paths(raw_files)
 
     def delete_file(self):
+        archive_pool.evict(self.archive_file)
         send2trash(self.archive_file)
 
     def generate_image_hash(self, index=None):
-        return Utils.generate_hash_from_source(self.get_raw_image(index))
+        index = index if index is not None else 0
+        member = self.get_raw_files()[index]
+        return hash_cache.get_hash(self.archive_file,
+                                   lambda: Utils.generate_hash_from_source(self.get_raw_image(index)),
+                                   member=member)
 
     def generate_archive_hash(self):
         with open(self.archive_file, "rb") as archive:
@@ -738,11 +897,12 @@ class ArchiveGallery(GenericGallery):
     def file_belongs_to_gallery(self, f: str):
         return f == self.archive_file
 
-    def file_moved(self, destination):
+    def file_moved(self, destination, refresh=True):
         with self.lock:
             self.change_archive_file(destination)
-            self.reset_files()
-            self.reset_filesystem_data()
+            if refresh:
+                self.reset_files()
+                self.reset_filesystem_data()
 
     def folder_moved(self, source, destination):
         with self.lock:
@@ -750,41 +910,40 @@ class ArchiveGallery(GenericGallery):
             self.reset_files()
 
     def file_deleted(self):
+        archive_pool.evict(self.archive_file)
         return True
 
+    def gallery_deleted(self):
+        archive_pool.evict(self.archive_file)
+        super().gallery_deleted()
+
+    def release(self):
+        archive_pool.evict(self.archive_file)
+        super().release()
+
 
 class ZipGallery(ArchiveGallery):
     ARCHIVE_EXTS = (".zip", ".cbz")
+    ARCHIVE_FORMAT = "zip"
     type = GalleryIDMap.ZipGallery.value
 
-    @property
-    @contextmanager
-    def archive(self):
-        archive = None
+    def open_archive(self):
+        # Passing our own file object keeps member reads on this fd instead of reopening the archive
+        fp = open(self.archive_file, "rb")
         try:
-            archive = zipfile.ZipFile(self.archive_file, "r")
-            yield archive
+            return zipfile.ZipFile(fp, "r"), fp
         except Exception:
-            self.logger.error("Failed to complete archive op for %s" % self.archive_file, exc_info=True)
-            raise exceptions.UnknownArchiveError()
-        finally:
-            archive and archive.close()
+            fp.close()
+            raise
 
 
 class RarGallery(ArchiveGallery):
     ARCHIVE_EXTS = (".rar", ".cbr")
+    ARCHIVE_FORMAT = "rar"
     type = GalleryIDMap.RarGallery.value
-    _archive = None
 
-    @property
-    @contextmanager
-    def archive(self):
-        try:
-            archive = rarfile.RarFile(self.archive_file, "r")
-            yield archive
-        except Exception:
-            self.logger.error("Failed to complete archive op for %s" % self.archive_file, exc_info=True)
-            raise exceptions.UnknownArchiveError()
+    def open_archive(self):
+        return rarfile.RarFile(self.archive_file, "r"), None
 
 
 class GalleryClassMap(Enum):
@@ -0,0 +1,89 @@
+from typing import List
+from PyQt5 import QtCore
+from .gallery import GenericGallery
+from .logger import Logger
+
+
+class GalleryModel(QtCore.QAbstractListModel, Logger):
+    """
+    List model of the galleries on the displayed page, exposed to QML as galleryModel.
+    Roles are read from the galleries only when a delegate asks for them, and page changes are sent
+    as a single dataChanged over the replaced rows plus inserts/removals for the difference in length.
+    Changes can be requested from any thread, they're applied on the thread the model lives in.
+    """
+
+    ROLES = GenericGallery.JSON_KEYS
+
+    countChanged = QtCore.pyqtSignal()
+    galleriesRequested = QtCore.pyqtSignal(list)
+    galleryUpdateRequested = QtCore.pyqtSignal(object)
+    galleryRemovalRequested = QtCore.pyqtSignal(object)
+
+    def __init__(self, parent: QtCore.QObject = None):
+        super().__init__(parent)
+        self.galleries = []  # type: List[GenericGallery]
+        self.role_names = {QtCore.Qt.UserRole + i + 1: role for i, role in enumerate(self.ROLES)}
+        self.galleriesRequested.connect(self._set_galleries)
+        self.galleryUpdateRequested.connect(self._update_gallery)
+        self.galleryRemovalRequested.connect(self._remove_gallery)
+
+    def roleNames(self):
+        return {key: QtCore.QByteArray(role.encode("utf8")) for key, role in self.role_names.items()}
+
+    def rowCount(self, parent=QtCore.QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.galleries)
+
+    def data(self, index: QtCore.QModelIndex, role: int = QtCore.Qt.DisplayRole):
+        role = self.role_names.get(role)
+        if role is None or not index.isValid() or not 0 <= index.row() < len(self.galleries):
+            return QtCore.QVariant()
+        return self.galleries[index.row()].get_json_value(role)
+
+    def get_count(self) -> int:
+        return len(self.galleries)
+
+    count = QtCore.pyqtProperty(int, fget=get_count, notify=countChanged)
+
+    def set_galleries(self, galleries: List[GenericGallery]):
+        self.galleriesRequested.emit(list(galleries))
+
+    def update_gallery(self, gallery: GenericGallery):
+        self.galleryUpdateRequested.emit(gallery)
+
+    def remove_gallery(self, gallery: GenericGallery):
+        self.galleryRemovalRequested.emit(gallery)
+
+    def _set_galleries(self, galleries: List[GenericGallery]):
+        old_count = len(self.galleries)
+        new_count = len(galleries)
+        if new_count < old_count:
+            self.beginRemoveRows(QtCore.QModelIndex(), new_count, old_count - 1)
+            del self.galleries[new_count:]
+            self.endRemoveRows()
+        changed_rows = [i for i in range(min(old_count, new_count)) if self.galleries[i] is not galleries[i]]
+        if changed_rows:
+            self.galleries[:len(self.galleries)] = galleries[:len(self.galleries)]
+            self.dataChanged.emit(self.index(changed_rows[0]), self.index(changed_rows[-1]))
+        if new_count > old_count:
+            self.beginInsertRows(QtCore.QModelIndex(), old_count, new_count - 1)
+            self.galleries += galleries[old_count:]
+            self.endInsertRows()
+        if new_count != old_count:
+            self.countChanged.emit()
+
+    def _update_gallery(self, gallery: GenericGallery):
+        try:
+            row = self.galleries.index(gallery)
+        except ValueError:
+            return
+        self.dataChanged.emit(self.index(row), self.index(row))
+
+    def _remove_gallery(self, gallery: GenericGallery):
+        try:
+            row = self.galleries.index(gallery)
+        except ValueError:
+            return
+        self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+        self.galleries.pop(row)
+        self.endRemoveRows()
+        self.countChanged.emit()
@@ -0,0 +1,139 @@
+import os
+from threading import RLock
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from sqlalchemy import select, delete, insert, and_
+from PandaViewer import user_database
+from .logger import Logger
+
+
+class HashCache(Logger):
+    """
+    Persistent cache for content hashes of images and archive members.
+    Entries are keyed by (path, member) and are only reused while the size and mtime_ns of the
+    file on disk match the values recorded when the hash was generated.
+    For archive members the stat values of the archive itself are used.
+    Entries of deleted galleries are dropped with forget, otherwise the table would keep growing.
+    """
+
+    FLUSH_THRESHOLD = 500
+    CHUNK_SIZE = 500
+
+    def __init__(self):
+        self.lock = RLock()
+        self.entries = None  # type: Dict[Tuple[str, str], Tuple[int, int, str]]
+        self.members = {}  # type: Dict[str, Set[str]]
+        self.dirty = set()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        with self.lock:
+            if self.entries is not None:
+                return
+            self.logger.debug("Loading hash cache from database.")
+            with user_database.get_session(self) as session:
+                rows = session.execute(select([user_database.HashCache])).fetchall()
+            self.entries = {(row["path"], row["member"]): (row["size"], row["mtime_ns"], row["hash"])
+                            for row in rows}
+            self.members = {}
+            for path, member in self.entries:
+                self.members.setdefault(path, set()).add(member)
+            self.logger.debug("Loaded %s hash cache entries." % len(self.entries))
+
+    def get_hash(self, path: str, generator: Callable[[], str], member: str = "") -> str:
+        """
+        Returns the cached hash for the given file/member, calling generator to create it on a miss.
+        :param path: path of the file on disk (the archive file for archive members)
+        :param generator: callable returning the hash of the file/member
+        :param member: name of the member inside the archive, if any
+        """
+        stat = os.stat(path)
+        file_hash = self.get_cached_hash(path, member, stat)
+        if file_hash is not None:
+            return file_hash
+        file_hash = generator()
+        new_stat = os.stat(path)
+        if (new_stat.st_size, new_stat.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return file_hash  # File changed while it was being hashed, don't cache the result
+        self.set_hash(path, file_hash, stat.st_size, stat.st_mtime_ns, member=member)
+        return file_hash
+
+    def get_cached_hash(self, path: str, member: str = "", stat: os.stat_result = None) -> Optional[str]:
+        """
+        Returns the cached hash for the given file/member, or None if it isn't cached or the file changed.
+        """
+        self.load()
+        stat = stat or os.stat(path)
+        with self.lock:
+            entry = self.entries.get((path, member))
+            if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+    def set_hash(self, path: str, file_hash: str, size: int, mtime_ns: int, member: str = ""):
+        """
+        Caches a hash that was generated while the file had the given size and mtime_ns.
+        """
+        self.load()
+        key = (path, member)
+        with self.lock:
+            self.entries[key] = (size, mtime_ns, file_hash)
+            self.members.setdefault(path, set()).add(member)
+            self.dirty.add(key)
+            need_flush = len(self.dirty) >= self.FLUSH_THRESHOLD
+        if need_flush:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            rows = []
+            for path, member in self.dirty:
+                size, mtime_ns, file_hash = self.entries[(path, member)]
+                rows.append({
+                    "path": path,
+                    "member": member,
+                    "size": size,
+                    "mtime_ns": mtime_ns,
+                    "hash": file_hash,
+                })
+            self.dirty = set()
+        self.logger.debug("Saving %s hash cache entries." % len(rows))
+        with user_database.get_session(self, acquire=True) as session:
+            for row in rows:
+                session.execute(delete(user_database.HashCache).where(and_(
+                    user_database.HashCache.path == row["path"],
+                    user_database.HashCache.member == row["member"])))
+            session.execute(insert(user_database.HashCache), rows)
+
+    def forget(self, paths: List[str]):
+        """
+        Drops the entries of the given files, including every member for archives.
+        """
+        self.load()
+        with self.lock:
+            paths = [path for path in paths if path in self.members]
+            for path in paths:
+                for member in self.members.pop(path):
+                    self.entries.pop((path, member), None)
+                    self.dirty.discard((path, member))
+        if not paths:
+            return
+        self.logger.debug("Forgetting hash cache entries of %s files." % len(paths))
+        with user_database.get_session(self, acquire=True) as session:
+            for i in range(0, len(paths), self.CHUNK_SIZE):
+                session.execute(delete(user_database.HashCache).where(
+                    user_database.HashCache.path.in_(paths[i:i + self.CHUNK_SIZE])))
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = 100.0 * self.hits / total if total else 0.0
+        self.logger.info("Hash cache hits: %s, misses: %s (%.1f%% hit rate)" % (self.hits, self.misses, hit_rate))
+
+    @property
+    def stats(self) -> Tuple[int, int]:
+        return self.hits, self.misses
+
+hash_cache = HashCache()
@@ -0,0 +1,28 @@
+from PyQt5 import QtCore, QtGui, QtQuick
+import PandaViewer
+from .logger import Logger
+
+
+class ArchiveImageProvider(QtQuick.QQuickImageProvider, Logger):
+    """
+    Serves the images of archive galleries to QML as image://archive/<ui uuid>/<index>.
+    Images are read straight from the archive, so showing the files of an archive doesn't extract it.
+    """
+
+    NAME = "archive"
+
+    def __init__(self):
+        super().__init__(QtQuick.QQuickImageProvider.Image)
+
+    def requestImage(self, image_id: str, requested_size: QtCore.QSize):
+        image = QtGui.QImage()
+        try:
+            uuid, index = image_id.split("/")
+            gallery = PandaViewer.app.get_gallery_by_ui_uuid(uuid)
+            scale = None
+            if requested_size.width() > 0:
+                scale = lambda size: size.scaled(requested_size.width(), size.height(), QtCore.Qt.KeepAspectRatio)
+            image = gallery.get_image(index=int(index), scale=scale)
+        except Exception:
+            self.logger.warning("Failed to load archive image %s" % image_id, exc_info=True)
+        return image, image.size()
@@ -52,8 +52,8 @@ class MetadataManager(Logger):
     def save(self, metadata: 'MetadataClassMap'):
         self.metadata.get(metadata.name).save()
 
-    def save_all(self):
-        for metadata in self.metadata.values(): metadata.save()
+    def save_all(self, session=None):
+        for metadata in self.metadata.values(): metadata.save(session=session)
 
     def delete(self, metadata: 'MetadataClassMap'):
         self.get_metadata(metadata=metadata).delete()
@@ -159,29 +159,33 @@ class Metadata(Logger):
         assert hasattr(self, key)
         setattr(self, key, value)
 
-    def save(self):
+    def save(self, session=None):
+        """
+        :param session: session of an ongoing transaction to save in, a new one is used if not given
+        """
+        if session is None:
+            with user_database.get_session(self, acquire=True) as session:
+                return self.save(session=session)
         if self.db_id is None:
-            self.create()
+            self.create(session)
         else:
             self.logger.info("{SELF} saving metadata".format(SELF=self))
-            with user_database.get_session(self, acquire=True) as session:
-                session.execute(update(user_database.Metadata).where(user_database.Metadata.id == self.db_id).values(
-                    {
-                        "json": self.str_json,
-                    }
-                ))
-
-    def create(self):
-        self.logger.info("{SELF} creating db entry".format(SELF=self))
-        with user_database.get_session(self, acquire=True) as session:
-            result = session.execute(insert(user_database.Metadata).values(
+            session.execute(update(user_database.Metadata).where(user_database.Metadata.id == self.db_id).values(
                 {
                     "json": self.str_json,
-                    "name": self.DB_NAME,
-                    "gallery_id": self.manager.gallery.db_id,
                 }
             ))
-            self.db_id = int(result.inserted_primary_key[0])
+
+    def create(self, session):
+        self.logger.info("{SELF} creating db entry".format(SELF=self))
+        result = session.execute(insert(user_database.Metadata).values(
+            {
+                "json": self.str_json,
+                "name": self.DB_NAME,
+                "gallery_id": self.manager.gallery.db_id,
+            }
+        ))
+        self.db_id = int(result.inserted_primary_key[0])
 
     def delete(self):
         self.logger.info("{SELF} deleting db entry".format(SELF=self))
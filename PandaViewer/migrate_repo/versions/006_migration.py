@@ -0,0 +1,31 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+hash_cache = Table('hash_cache', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('path', Text, nullable=False),
+    Column('member', Text, nullable=False, default=ColumnDefault('')),
+    Column('size', Integer, nullable=False),
+    Column('mtime_ns', Integer, nullable=False),
+    Column('hash', Text, nullable=False),
+    Index('ix_hash_cache_path_member', 'path', 'member', unique=True),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['hash_cache'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['hash_cache'].drop()
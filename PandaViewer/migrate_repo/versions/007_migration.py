@@ -0,0 +1,30 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+directory_snapshot = Table('directory_snapshot', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('path', Text, nullable=False, unique=True),
+    Column('mtime_ns', Integer, nullable=False),
+    Column('entry_count', Integer, nullable=False),
+    Column('digest', Text, nullable=False),
+    Column('subdirectories', Text, nullable=False, default=ColumnDefault('[]')),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['directory_snapshot'].create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    post_meta.tables['directory_snapshot'].drop()
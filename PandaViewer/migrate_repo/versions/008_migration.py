@@ -0,0 +1,51 @@
+from sqlalchemy import *
+from migrate import *
+
+
+from migrate.changeset import schema
+pre_meta = MetaData()
+post_meta = MetaData()
+gallery = Table('gallery', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('favorite', Boolean),
+    Column('dead', Boolean, default=ColumnDefault(False)),
+    Column('path', Text),
+    Column('type', Integer, nullable=False),
+    Column('thumbnail_source', Text, nullable=False, default=ColumnDefault('0')),
+    Column('image_hash', Text),
+    Column('uuid', Text, nullable=False),
+    Column('mtime_hash', Text),
+    Column('last_read', Integer),
+    Column('read_count', Integer, nullable=False, default=ColumnDefault(0)),
+    Column('time_added', Integer),
+    Index('ix_gallery_uuid_type_dead', 'uuid', 'type', 'dead'),
+    Index('ix_gallery_dead_image_hash', 'dead', 'image_hash'),
+    Index('ix_gallery_path', 'path'),
+)
+
+metadata = Table('metadata', post_meta,
+    Column('id', Integer, primary_key=True, nullable=False),
+    Column('name', Text, nullable=False),
+    Column('json', Text),
+    Column('gallery_id', Integer),
+    Index('ix_metadata_gallery_id', 'gallery_id'),
+)
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine; bind
+    # migrate_engine to your metadata
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    for table in ('gallery', 'metadata'):
+        for index in post_meta.tables[table].indexes:
+            index.create()
+
+
+def downgrade(migrate_engine):
+    # Operations to reverse the above upgrade go here.
+    pre_meta.bind = migrate_engine
+    post_meta.bind = migrate_engine
+    for table in ('gallery', 'metadata'):
+        for index in post_meta.tables[table].indexes:
+            index.drop()
@@ -0,0 +1,142 @@
+import os
+from threading import RLock
+from typing import Dict, List, Optional, Set, Tuple
+import PandaViewer
+from .logger import Logger
+
+
+class PathTrieNode(object):
+
+    def __init__(self):
+        self.children = {}  # type: Dict[str, PathTrieNode]
+        self.galleries = set()  # type: Set[PandaViewer.gallery.GenericGallery]
+
+
+class PathTrie(object):
+    """
+    Prefix tree over path components, used to find every gallery inside a directory
+    in O(path depth + number of results).
+    """
+
+    def __init__(self):
+        self.root = PathTrieNode()
+
+    @staticmethod
+    def split(path: str) -> List[str]:
+        return [p for p in path.split(os.sep) if p]
+
+    def add(self, path: str, gallery: 'PandaViewer.gallery.GenericGallery'):
+        node = self.root
+        for part in self.split(path):
+            node = node.children.setdefault(part, PathTrieNode())
+        node.galleries.add(gallery)
+
+    def remove(self, path: str, gallery: 'PandaViewer.gallery.GenericGallery'):
+        nodes = [self.root]
+        parts = self.split(path)
+        for part in parts:
+            node = nodes[-1].children.get(part)
+            if node is None:
+                return
+            nodes.append(node)
+        nodes[-1].galleries.discard(gallery)
+        for part, parent, node in reversed(list(zip(parts, nodes, nodes[1:]))):
+            if node.galleries or node.children:
+                break
+            parent.children.pop(part)
+
+    def find(self, directory: str) -> List['PandaViewer.gallery.GenericGallery']:
+        """
+        Returns all galleries stored at or below directory.
+        """
+        node = self.root
+        for part in self.split(directory):
+            node = node.children.get(part)
+            if node is None:
+                return []
+        galleries = []
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            galleries += node.galleries
+            nodes += node.children.values()
+        return galleries
+
+
+class PathIndex(Logger):
+    """
+    Thread safe map of normalized gallery locations to their galleries.
+    Galleries are also indexed by their folder in a PathTrie so directory events can be resolved
+    without going through every gallery.
+    Paths of candidates that are still being turned into galleries can be reserved so that the same
+    path isn't picked up twice by concurrent scans.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.galleries = {}  # type: Dict[str, PandaViewer.gallery.GenericGallery]
+        self.locations = {}  # type: Dict[PandaViewer.gallery.GenericGallery, Tuple[str, str]]
+        self.reserved = set()  # type: Set[str]
+        self.folders = PathTrie()
+
+    def __contains__(self, path: str) -> bool:
+        with self.lock:
+            return path in self.galleries or path in self.reserved
+
+    def __len__(self) -> int:
+        return len(self.galleries)
+
+    def get(self, path: str) -> Optional['PandaViewer.gallery.GenericGallery']:
+        return self.galleries.get(path)
+
+    def contains_gallery(self, gallery: 'PandaViewer.gallery.GenericGallery') -> bool:
+        return gallery in self.locations
+
+    def reserve(self, path: str) -> bool:
+        """
+        Reserves path for a gallery that is about to be created.
+        :return: False if the path is already indexed or reserved
+        """
+        with self.lock:
+            if path in self.galleries or path in self.reserved:
+                return False
+            self.reserved.add(path)
+            return True
+
+    def release(self, path: str):
+        with self.lock:
+            self.reserved.discard(path)
+
+    def add(self, gallery: 'PandaViewer.gallery.GenericGallery'):
+        location = gallery.location
+        folder = gallery.folder
+        with self.lock:
+            self.remove(gallery)
+            self.reserved.discard(location)
+            self.galleries[location] = gallery
+            self.locations[gallery] = (location, folder)
+            self.folders.add(folder, gallery)
+
+    def remove(self, gallery: 'PandaViewer.gallery.GenericGallery'):
+        with self.lock:
+            location, folder = self.locations.pop(gallery, (None, None))
+            if location is None:
+                return
+            if self.galleries.get(location) is gallery:
+                self.galleries.pop(location)
+            self.folders.remove(folder, gallery)
+
+    def galleries_under(self, directory: str) -> List['PandaViewer.gallery.GenericGallery']:
+        """
+        Returns every indexed gallery whose folder is directory or inside of it.
+        """
+        with self.lock:
+            return self.folders.find(directory)
+
+    def update(self, gallery: 'PandaViewer.gallery.GenericGallery'):
+        """
+        Re-indexes gallery after its location changed.
+        """
+        with self.lock:
+            if gallery in self.locations:
+                self.add(gallery)
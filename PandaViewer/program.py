@@ -1,18 +1,26 @@
 import os
-import re
 import gc
 from enum import Enum
 from random import randint
 from threading import RLock
 from typing import List, Dict, Tuple
-from bisect import insort_left
-from operator import attrgetter
 from PyQt5 import QtCore, QtQml, QtQuick, QtNetwork, QtWidgets, QtGui
 from . import threads, exceptions, user_database, metadata
 from .utils import Utils
 from .logger import Logger
 from .config import Config
 from .gallery import GenericGallery
+from .hash_cache import hash_cache
+from .archive_pool import archive_pool
+from .extraction_cache import extraction_cache
+from .unit_of_work import unit_of_work
+from .directory_snapshots import directory_snapshots
+from .path_index import PathIndex
+from .search_index import SearchIndex, SearchQuery
+from .tag_vocabulary import TagVocabulary
+from .sort_index import SortIndex
+from .gallery_model import GalleryModel
+from .image_provider import ArchiveImageProvider
 
 
 class Program(QtWidgets.QApplication, Logger):
@@ -37,13 +45,19 @@ class Program(QtWidgets.QApplication, Logger):
         self.setOrganizationName("PV")
         self.setOrganizationDomain(self.BUG_PAGE)
         self.setApplicationName("PandaViewer")
-        self.tags = []  # type: List[str]
-        self.pages = [[]]  # type: List[List[GenericGallery]]
+        self.tag_vocabulary = TagVocabulary()
+        self.results = []  # type: List[GenericGallery]
         self.galleries = []  # type: List[GenericGallery]
+        self.galleries_version = 0
+        self._visible_galleries = (None, [])  # type: Tuple[Tuple[int, int], List[GenericGallery]]
+        self.path_index = PathIndex()
+        self.search_index = SearchIndex()
+        self.sort_index = SortIndex([t.value for t in self.SortMethodMap])
         self.removed_galleries = [] #  type: List[GenericGallery]
         self.version = "0.1"  # Most likely used for db changes only
         self.page_number = 0
         self.search_text = ""
+        self.scanning = False  # Gallery thread has a scan in flight, scanning mode stays on until it's done
 
     def setup(self):
         if not os.path.exists(self.THUMB_DIR):
@@ -52,6 +66,10 @@ class Program(QtWidgets.QApplication, Logger):
 
         self.qml_engine = QtQml.QQmlApplicationEngine()
         self.qml_engine.addImportPath(self.QML_PATH)
+        self.gallery_model = GalleryModel(self)
+        self.qml_engine.rootContext().setContextProperty("galleryModel", self.gallery_model)
+        self.archive_image_provider = ArchiveImageProvider()
+        self.qml_engine.addImageProvider(ArchiveImageProvider.NAME, self.archive_image_provider)
         # self.qml_engine.addPluginPath(self.QML_PATH)
         self.setAttribute(QtCore.Qt.AA_UseOpenGLES, True)
         self.qml_engine.load(os.path.join(self.QML_PATH, "main.qml"))
@@ -75,19 +93,10 @@ class Program(QtWidgets.QApplication, Logger):
         self.app_window.getGalleryImageFolder.connect(self.get_gallery_image_folder)
         self.app_window.setGalleryImage.connect(self.set_gallery_image)
         self.app_window.setUISort.emit(Config.sort_type, 1 if Config.sort_mode_reversed else 0)
-        self.completer_line = QtWidgets.QLineEdit()
-        self.completer_line.hide()
-        self.setup_completer()
         self.setWindowIcon(QtGui.QIcon(Utils.convert_from_relative_path("icon.ico")))
         self.set_ui_config()
         self.app_window.show()
 
-    def setup_completer(self):
-        self.completer = QtWidgets.QCompleter(self.tags)
-        self.completer.setModelSorting(self.completer.CaseInsensitivelySortedModel)
-        self.completer.setCaseSensitivity(QtCore.Qt.CaseInsensitive)
-        self.completer_line.setCompleter(self.completer)
-
     def set_sorting(self, sort_type, reversed):
         Config.sort_type = sort_type
         Config.sort_mode_reversed = reversed
@@ -100,25 +109,21 @@ class Program(QtWidgets.QApplication, Logger):
         self.search()
 
     def set_ui_gallery(self, gallery: GenericGallery):
-        self.app_window.setGallery.emit(gallery.ui_uuid, gallery.get_json())
+        gallery.invalidate_json()
+        self.gallery_model.update_gallery(gallery)
+        self.app_window.setGallery.emit(gallery.ui_uuid, gallery.get_json())  # Customization page
 
     def remove_gallery_by_uuid(self, uuid: str):
         gallery = self.get_gallery_by_ui_uuid(uuid)
+        self.gallery_model.remove_gallery(gallery)
         gallery.mark_for_deletion() # Also removes
-        self.setup_tags()
+        self.update_gallery_indexes(gallery)
 
     def get_detailed_gallery(self, uuid: str):
         self.app_window.openDetailedGallery.emit(self.get_gallery_by_ui_uuid(uuid).get_detailed_json())
 
     def get_tags_from_search(self, search: str):
-        self.completer_line.setText(search)
-        self.completer.setCompletionPrefix(search)
-        tags = []
-        for i in range(self.completer.completionCount()):
-            self.completer.setCurrentRow(i)
-            tags.append(self.completer.currentCompletion())
-        tags.sort(key=len)
-        self.app_window.setTags(tags[:self.MAX_TAG_RETURN_COUNT])
+        self.app_window.setTags(self.tag_vocabulary.complete(search, self.MAX_TAG_RETURN_COUNT))
 
     def get_gallery_by_ui_uuid(self, uuid: str) -> GenericGallery:
         assert uuid
@@ -137,8 +142,11 @@ class Program(QtWidgets.QApplication, Logger):
     def open_gallery(self, uuid, index):
         self.get_gallery_by_ui_uuid(uuid).open(index)
 
+    def prefetch_gallery_files(self, gallery: GenericGallery, index: int):
+        threads.prefetch_thread.queue.put((gallery, index))
+
     def open_random_gallery(self):
-        galleries = self.filter_galleries(self.galleries)
+        galleries = self.visible_galleries
         index = randint(0, len(galleries) - 1)
         galleries[index].open()
 
@@ -157,11 +165,20 @@ class Program(QtWidgets.QApplication, Logger):
 
     @property
     def current_page(self) -> List[GenericGallery]:
-        return self.pages[self.page_number]
+        return self.get_page(self.page_number)
 
     @property
     def page_count(self) -> int:
-        return len(self.pages)
+        return max((len(self.results) + self.PAGE_SIZE - 1) // self.PAGE_SIZE, 1)
+
+    def get_page(self, page_number: int) -> List[GenericGallery]:
+        """
+        Pages are computed from the ordered search results on demand instead of being stored.
+        """
+        if not 0 <= page_number < self.page_count:
+            raise IndexError(page_number)
+        start = page_number * self.PAGE_SIZE
+        return self.results[start:start + self.PAGE_SIZE]
 
     def set_ui_config(self):
         self.app_window.setSettings(Config.get_ui_config())
@@ -188,53 +205,22 @@ class Program(QtWidgets.QApplication, Logger):
                     metadata_changed = True
                     metadata_entry.auto_collection = auto_collection
             if metadata_changed:
-                gallery.save_metadata(update_ui=False)
-
-    def process_search(self, search_text: str) -> (List[str], [List[str], str]):
-        search_text = search_text.lower()
-        quote_regex = re.compile(r"(-)?\"(.*?)\"")
-        filter_regex = re.compile(r"(?:^|\s)\-(.*?)(?=(?:$|\ ))")
-        rating_method = re.search(r"rating:(\S*)", search_text)
-        if rating_method:
-            search_text = re.sub("rating:\S*", "", search_text)
-            rating_method = rating_method.groups()[0]
-            if rating_method:
-                if rating_method[0] == "=" and rating_method[1] != "=":
-                    rating_method = "=" + rating_method
-                try:
-                    eval("0.0" + rating_method)
-                except:
-                    raise exceptions.InvalidRatingSearch
-            else:
-                raise exceptions.InvalidRatingSearch
-        quoted_words = re.findall(quote_regex, search_text)
-        quoted_words = " ".join(map(lambda x: "".join(x).replace(" ", "_"), quoted_words))
-        search_text = re.sub(quote_regex, "", search_text) + quoted_words
-        filter_words = re.findall(filter_regex, search_text)
-        words = re.sub(filter_regex, "", search_text).split()
-        self.logger.info("Search words: %s" % words)
-        self.logger.info("Filter words: %s" % filter_words)
-        self.logger.info("Rating function: %s" % rating_method)
-        return words, filter_words, rating_method
+                unit_of_work.add(gallery)
+        unit_of_work.flush()
+
+    def process_search(self, search_text: str) -> SearchQuery:
+        query = SearchQuery.compile(search_text)
+        self.logger.info("Search words: %s" % query.words)
+        self.logger.info("Filter words: %s" % query.filters)
+        self.logger.info("Rating comparisons: %s" % query.rating_comparisons)
+        return query
 
     def search(self):
         self.logger.info("Search_text: %s" % self.search_text)
         if self.search_text:
-            words, filters, rating_method = self.process_search(self.search_text)
-            galleries = []
+            query = self.process_search(self.search_text)
             with self.gallery_lock:
-                for gallery in self.filter_galleries(self.galleries):
-                    if gallery.expired:
-                        continue
-                    title = gallery.clean_name.lower().split()
-                    rating = gallery.metadata_manager.get_value("rating")
-                    tags = [t.replace(" ", "_").lower() for t in gallery.metadata_manager.all_tags]
-                    if rating_method and (not rating or not eval(str(rating) + rating_method)):
-                        continue
-                    if any(self.in_search(tags, title, w) for w in filters):
-                        continue
-                    if all(self.in_search(tags, title, w) for w in words) or len(words) == 0:
-                        galleries.append(gallery)
+                galleries = query.execute(self.search_index, self.visible_galleries)
             self.app_window.setNoSearchResults.emit(not bool(galleries))
             self.setup_pages(galleries)
             self.show_page()
@@ -243,60 +229,53 @@ class Program(QtWidgets.QApplication, Logger):
             self.setup_pages()
             self.show_page()
 
-    @staticmethod
-    def in_search(tags: List[str], title: str, input_tag: str) -> bool:
-        input_tag, namespace = Utils.separate_tag(input_tag)
-        for title_word in title:
-            if input_tag in title_word:
-                return True
-        for tag in tags:
-            tag, tag_namespace = Utils.separate_tag(tag)
-            if input_tag in tag and (namespace is None or tag_namespace == namespace):
-                return True
-        return False
-
     def setup_tags(self):
-        tags = []
-        # tag_count_map = {}
-        for gallery in self.filter_galleries(self.galleries):
-            new_tags = list(set(map(lambda x: x.replace(" ", "_").lower(), gallery.metadata_manager.all_tags)))
-            # for tag in new_tags:
-            #     tag_count_map[tag] = tag_count_map.get(tag, 0) + 1
-            tags += new_tags
-        self.tags = list(set(tags))
-        for tag in self.tags[:]:
-            raw_tag, namespace = Utils.separate_tag(tag)
-            if namespace:
-                self.tags.append(raw_tag)
-        self.tags += list(map(lambda x: "-" + x, self.tags))
-        self.tags = list(set(self.tags))
-        self.tags.sort()
-        self.setup_completer()
+        """
+        Fully resyncs the tag vocabulary with the visible galleries.
+        Only needed when gallery visibility changes, metadata changes go through update_gallery_indexes.
+        """
+        with self.gallery_lock:
+            self.tag_vocabulary.sync(self.visible_galleries)
 
     def find_galleries(self, initial: bool = False):
+        self.scanning = True
         self.app_window.setScanningMode(True)
         self.logger.debug("Sending start signal to gallery thread")
         folders = Config.folders[:] if not initial else None
         threads.gallery_thread.queue.put(folders)
 
-    def find_galleries_done(self, galleries: List[GenericGallery]):
-        self.app_window.setScanningMode(False)
+    def add_galleries(self, galleries: List[GenericGallery]):
+        """
+        Adds a batch of galleries sent by the gallery thread while it is still running.
+        The displayed page is only refreshed until the first page is filled, the rest are
+        shown once the gallery thread is done, which is also when scanning mode is cleared.
+        """
         self.set_auto_metadata_collection(galleries)
         with self.gallery_lock:
             self.galleries += galleries
+            self.invalidate_visible_galleries()
+            self.sort_index.add_all(galleries)
+            for gallery in galleries:
+                self.path_index.add(gallery)
+                self.search_index.update(gallery)
+                if self.gallery_is_visible(gallery):
+                    self.tag_vocabulary.update(gallery)
+        self.logger.debug("Added batch of %s galleries" % len(galleries))
+        if len(self.current_page) < self.PAGE_SIZE:
+            self.sort()
+            self.search()
+
+    def find_galleries_done(self):
+        self.scanning = False
+        self.app_window.setScanningMode(False)
         self.logger.debug("Gallery thread done")
-        self.setup_tags()
         self.sort()
         self.search()
 
     def send_page(self, reset_scroll=True):
-        index_list = (i for i in range(0, self.PAGE_SIZE))
-        for gallery in self.current_page:
-            self.app_window.setUIGallery.emit(next(index_list), gallery.get_json(), reset_scroll)
-        for i in list(index_list)[::-1]: self.app_window.removeUIGallery.emit(i, 1)
-        # index_list = list(index_list)
-        # if index_list:
-        #     self.app_window.removeUIGallery.emit(index_list[0], len(index_list))
+        if reset_scroll:
+            self.app_window.scrollToTop.emit()
+        self.gallery_model.set_galleries(self.current_page)
         self.garbage_collect()
         threads.image_thread.bg_run_count = 0
 
@@ -321,14 +300,15 @@ class Program(QtWidgets.QApplication, Logger):
         threads.image_thread.queue.put(galleries)
 
     def image_thread_done(self):
-        self.app_window.setScanningMode(False)
+        if not self.scanning:  # Thumbnails of a streamed batch, the scan is still running
+            self.app_window.setScanningMode(False)
         self.logger.debug("Image thread done.")
         self.send_page()
 
     def get_metadata(self, uuid: str):
         try:
             uuid = int(uuid)
-            galleries = [g for g in self.filter_galleries(self.galleries)
+            galleries = [g for g in self.visible_galleries
                          if g.metadata_manager.metadata_collection_enabled()]
             if uuid == -1:
                 for gallery in galleries:
@@ -346,36 +326,74 @@ class Program(QtWidgets.QApplication, Logger):
 
     def update_gallery_metadata(self, gallery: GenericGallery, metadata: dict):
         gallery.update_metadata(metadata)
-        gallery.save_metadata()
+        unit_of_work.add(gallery)  # Saved in batches, flushed once each search thread is done
+        gallery.update_ui_gallery()
+        self.update_gallery_indexes(gallery)
+
+    def update_gallery_indexes(self, gallery: GenericGallery):
+        """
+        Updates the indexes kept for gallery after its metadata changed.
+        """
+        gallery.invalidate_json()
+        if self.path_index.contains_gallery(gallery):
+            self.search_index.update(gallery)
+            self.sort_index.update(gallery)
+        if self.path_index.contains_gallery(gallery) and self.gallery_is_visible(gallery):
+            self.tag_vocabulary.update(gallery)
+        else:
+            self.tag_vocabulary.remove(gallery)
+            self.invalidate_visible_galleries()  # e.g. marked for deletion
+
+    def update_gallery_location(self, gallery: GenericGallery):
+        """
+        Updates the indexes kept for gallery after it was moved.
+        Galleries without a metadata title are named after their folder or archive, so the title changes too.
+        """
+        gallery.invalidate_json()
+        self.path_index.update(gallery)
+        self.search_index.update(gallery)
+        self.sort_index.update(gallery)
 
     def get_metadata_done(self):
         self.app_window.setSearchMode(False)
         self.logger.debug("Metadata thread done.")
-        self.setup_tags()
+        unit_of_work.flush()
+
+    def search_thread_done(self):
+        # Local DB matches are queued before the ex search is done, save them as soon as the local search ends
+        unit_of_work.flush()
 
     def remove_duplicates(self):
         self.app_window.setScanningMode(True)
-        threads.duplicate_thread.queue.put(self.filter_galleries(self.galleries))
+        threads.duplicate_thread.queue.put(list(self.visible_galleries))
 
     def duplicate_thread_done(self):
-        self.app_window.setScanningMode(False)
+        if not self.scanning:
+            self.app_window.setScanningMode(False)
+        self.invalidate_visible_galleries()  # Duplicates were marked for deletion without touching the cache
         self.setup_tags()
         self.sort()
 
     def close(self):
         try:
+            unit_of_work.flush()
             with self.gallery_lock:
                     for g in self.galleries: g.release()
             for g in self.removed_galleries: g.release()
+            hash_cache.flush()
+            archive_pool.close_all()
+            extraction_cache.save()
+            threads.image_thread.close()
         except:
             self.logger.error("Failed to complete release, check log", exc_info=True)
         self.quit()
 
     def sort(self):
-        key = attrgetter([t.value for t in self.SortMethodMap][Config.sort_type])
+        key = [t.value for t in self.SortMethodMap][Config.sort_type]
         assert key
         with self.gallery_lock:
-            self.galleries.sort(key=key, reverse=Config.sort_mode_reversed)
+            self.galleries = self.sort_index.get_sorted(key, reverse=Config.sort_mode_reversed)
+            self.invalidate_visible_galleries()
 
     def switch_page(self, page_num: int):
         self.page_number = int(page_num) - 1
@@ -383,49 +401,77 @@ class Program(QtWidgets.QApplication, Logger):
         self.app_window.setPage(self.page_number + 1)
 
     def filter_galleries(self, galleries: List[GenericGallery]) -> List[GenericGallery]:
-        return_galleries = []
-        for gallery in galleries:
-            if gallery.expired:
-                continue
-            if not any(Utils.path_exists_under_directory(d, gallery.folder) for d in Config.folders):
-                continue
-            return_galleries.append(gallery)
-        return return_galleries
+        return [g for g in galleries if self.gallery_is_visible(g)]
+
+    @property
+    def visible_galleries(self) -> List[GenericGallery]:
+        """
+        Cached filter_galleries(self.galleries), only recomputed after the gallery list or Config.folders changed.
+        The returned list is shared and must not be modified.
+        """
+        with self.gallery_lock:
+            version = (self.galleries_version, Config.folders_version)
+            cached_version, galleries = self._visible_galleries
+            if cached_version != version:
+                galleries = self.filter_galleries(self.galleries)
+                self._visible_galleries = (version, galleries)
+            return galleries
+
+    def invalidate_visible_galleries(self):
+        with self.gallery_lock:
+            self.galleries_version += 1
+
+    @staticmethod
+    def gallery_is_visible(gallery: GenericGallery) -> bool:
+        if gallery.expired:
+            return False
+        # gallery.folder is already normalized, so a prefix check is enough
+        return Utils.ensure_trailing_sep(gallery.folder).startswith(Config.folder_prefixes)
+
+    def get_gallery_by_file(self, path: str) -> GenericGallery:
+        """
+        Finds the visible gallery the given file belongs to, if any.
+        :param path: normalized path of an archive or of an image inside a folder gallery
+        """
+        for location in (path, os.path.dirname(path)):
+            gallery = self.path_index.get(location)
+            if gallery and gallery.file_belongs_to_gallery(path) and self.gallery_is_visible(gallery):
+                return gallery
 
     def setup_pages(self, galleries: List[GenericGallery] = None):
         if galleries is None:  # Need to do it this way because passing in galleries of [] would cause problems
-            galleries = self.galleries
-        galleries = self.filter_galleries(galleries)
-        self.pages = [galleries[i:i + self.PAGE_SIZE] for i in range(0, len(galleries), self.PAGE_SIZE)] or [[]]
+            self.results = list(self.visible_galleries)
+        else:
+            self.results = self.filter_galleries(galleries)
         self.app_window.setPageCount(self.page_count)
         self.page_number = 0
         self.app_window.setPage(self.page_number + 1)
 
     def remove_gallery_and_recalculate_pages(self, gallery: GenericGallery, force_assertion=True):
-        gallery_in_galleries = gallery in self.galleries
+        gallery_in_galleries = self.path_index.contains_gallery(gallery)
         if force_assertion:
             assert gallery_in_galleries
         elif not gallery_in_galleries:
             return
-        working_page = None
         with self.gallery_lock:
             self.galleries.remove(gallery)
-            for i in range(0, self.page_count):
-                if gallery in self.pages[i]:
-                    self.pages[i].remove(gallery)
-                    working_page = i
-                    break
-            assert working_page is not None
-            initial_page_is_displayed = working_page == self.page_number
-            while working_page < self.page_count - 1:
-                self.pages[working_page].append(self.pages[working_page + 1].pop(0))
-                working_page += 1
-            self.pages = [p for p in self.pages if p]
-            if self.page_number >= self.page_count:
-                self.switch_page(self.page_count)
-            elif initial_page_is_displayed:
-                self.show_page(reset_scroll=False)
+            self.invalidate_visible_galleries()
+            self.path_index.remove(gallery)
+            self.search_index.remove(gallery)
+            self.sort_index.remove(gallery)
+            self.tag_vocabulary.remove(gallery)
+            try:
+                index = self.results.index(gallery)
+            except ValueError:  # Not part of the current results
+                index = None
+            if index is not None:
+                del self.results[index]
+                if self.page_number >= self.page_count:
+                    self.switch_page(self.page_count)
+                elif index < (self.page_number + 1) * self.PAGE_SIZE:  # Displayed page shifted
+                    self.show_page(reset_scroll=False)
         self.removed_galleries.append(gallery)
+        directory_snapshots.invalidate(gallery.folder)
 
     def thread_exception_handler(self, thread, exception):
         self.exception_hook(*exception)
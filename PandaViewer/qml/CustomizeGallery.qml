@@ -306,10 +306,6 @@ Page {
         Layout.fillWidth: true
         __wheelAreaScrollSpeed: 100
 
-        function encodeURIComponents(uri) {
-            return uri.split('/').map(encodeURIComponent).join('/')
-        }
-
         anchors {
             left: filesHeader.left
             right: filesHeader.right
@@ -327,7 +323,7 @@ Page {
             delegate: Component {
                 Image {
                     id: pageImage
-                    source: "file:" + scrollView.encodeURIComponents(modelData)
+                    source: modelData
                     asynchronous: index > 10
                     width: 200
                     height: Math.min(Units.dp(300), implicitHeight)
@@ -9,9 +9,6 @@ Item {
     objectName: "galleries"
     property bool scanningMode: false
     property bool noSearchResults: false
-    ListModel {
-        id: galleryModel
-    }
 
     ProgressCircle {
         id: progressCircle
@@ -21,12 +18,9 @@ Item {
     }
 
     Component.onCompleted: {
-        mainWindow.removeGallery.connect(galleriesPage.removeGallery)
         mainWindow.scanningModeSet.connect(galleriesPage.setScanningMode)
-        mainWindow.setGallery.connect(galleriesPage.setGallery)
         mainWindow.setNoSearchResults.connect(galleriesPage.setNoSearchResults)
-        mainWindow.setUIGallery.connect(galleriesPage.setUIGallery)
-        mainWindow.removeUIGallery.connect(galleriesPage.removeUIGallery)
+        mainWindow.scrollToTop.connect(galleriesPage.scrollToTop)
         mainWindow.openDetailedGallery.connect(
                     galleriesPage.openDetailedGallery)
     }
@@ -37,34 +31,8 @@ Item {
                        })
     }
 
-    function removeGallery(uuid) {
-        galleryModel.remove(getIndexFromUUID(uuid))
-    }
-
-    function getIndexFromUUID(uuid) {
-        for (var i = 0; i < galleryModel.count; ++i) {
-            if (galleryModel.get(i).dbUUID === uuid) {
-                return i
-            }
-        }
-        return -1
-    }
-
-    function setGallery(uuid, gallery) {
-        galleryModel.set(getIndexFromUUID(uuid), gallery)
-    }
-
-    function setUIGallery(index, gallery, resetScroll) {
-        if (resetScroll) {
-            galleryLoader.item.positionViewAtBeginning()
-        }
-        galleryModel.set(index, gallery)
-    }
-
-    function removeUIGallery(index, count) {
-        if (index < galleryModel.count) {
-            galleryModel.remove(index)
-        }
+    function scrollToTop() {
+        galleryLoader.item.positionViewAtBeginning()
     }
 
     function setNoSearchResults(noResults) {
@@ -77,7 +45,7 @@ Item {
 
     states: [
         State {
-            when: galleriesPage.scanningMode
+            when: galleriesPage.scanningMode && galleryModel.count == 0
 
             PropertyChanges {
                 target: centerMessage
@@ -150,7 +118,8 @@ Item {
         },
 
         State {
-            when: !galleriesPage.scanningMode
+            // Batches streamed in during a scan are shown while scanning mode stays on
+            when: !galleriesPage.scanningMode || galleryModel.count > 0
             PropertyChanges {
                 target: progressCircle
                 visible: false
@@ -88,8 +88,7 @@ ApplicationWindow {
 
     signal pageChange(int page)
 
-    signal setUIGallery(int index, var gallery, bool resetScroll)
-    signal removeUIGallery(int index, int count)
+    signal scrollToTop
     signal getDetailedGallery(string uuid)
     signal setUISort(int sortType, int reversed)
     signal setDisplayModeToGrid(bool gridMode)
@@ -0,0 +1,234 @@
+import re
+import operator
+import functools
+from threading import RLock
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+import PandaViewer
+from . import exceptions
+from .utils import Utils
+from .logger import Logger
+
+
+class SubstringIndex(object):
+    """
+    Vocabulary of tokens with a trigram index to find every token containing a given substring
+    without scanning the whole vocabulary.
+    """
+
+    GRAM_SIZE = 3
+
+    def __init__(self):
+        self.tokens = set()  # type: Set[str]
+        self.grams = {}  # type: Dict[str, Set[str]]
+
+    @classmethod
+    def get_grams(cls, token: str) -> Set[str]:
+        return {token[i:i + cls.GRAM_SIZE] for i in range(0, len(token) - cls.GRAM_SIZE + 1)}
+
+    def add(self, token: str):
+        if token in self.tokens:
+            return
+        self.tokens.add(token)
+        for gram in self.get_grams(token):
+            self.grams.setdefault(gram, set()).add(token)
+
+    def remove(self, token: str):
+        if token not in self.tokens:
+            return
+        self.tokens.discard(token)
+        for gram in self.get_grams(token):
+            tokens = self.grams.get(gram)
+            tokens.discard(token)
+            if not tokens:
+                self.grams.pop(gram)
+
+    def find(self, substring: str) -> Iterable[str]:
+        if len(substring) < self.GRAM_SIZE:
+            return [t for t in self.tokens if substring in t]
+        candidates = None
+        for gram in sorted(self.get_grams(substring), key=lambda g: len(self.grams.get(g, ()))):
+            tokens = self.grams.get(gram)
+            if not tokens:
+                return []
+            candidates = tokens if candidates is None else candidates & tokens
+            if not candidates:
+                return []
+        return [t for t in candidates if substring in t]
+
+
+class SearchIndex(Logger):
+    """
+    Inverted index over gallery title words and namespaced tags.
+    A search term matches a gallery if it is a substring of one of its title words, or a substring of
+    one of its tags (restricted to the term's namespace, if it has one).
+    Galleries must be re-indexed with update whenever their title or tags change.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.documents = {}  # type: Dict[PandaViewer.gallery.GenericGallery, Tuple[FrozenSet, FrozenSet]]
+        self.title_postings = {}  # type: Dict[str, Set[PandaViewer.gallery.GenericGallery]]
+        self.tag_postings = {}  # type: Dict[str, Dict[Optional[str], Set[PandaViewer.gallery.GenericGallery]]]
+        self.title_words = SubstringIndex()
+        self.tags = SubstringIndex()
+
+    @staticmethod
+    def create_document(gallery: 'PandaViewer.gallery.GenericGallery') -> Tuple[FrozenSet, FrozenSet]:
+        title_words = frozenset(gallery.clean_name.lower().split())
+        tags = frozenset(Utils.separate_tag(t.replace(" ", "_").lower())
+                         for t in gallery.metadata_manager.all_tags)
+        return title_words, tags
+
+    def update(self, gallery: 'PandaViewer.gallery.GenericGallery'):
+        document = self.create_document(gallery)
+        with self.lock:
+            old_document = self.documents.get(gallery)
+            if old_document == document:
+                return
+            if old_document is not None:
+                self.remove(gallery)
+            self.documents[gallery] = document
+            title_words, tags = document
+            for word in title_words:
+                self.title_postings.setdefault(word, set()).add(gallery)
+                self.title_words.add(word)
+            for tag, namespace in tags:
+                self.tag_postings.setdefault(tag, {}).setdefault(namespace, set()).add(gallery)
+                self.tags.add(tag)
+
+    def remove(self, gallery: 'PandaViewer.gallery.GenericGallery'):
+        with self.lock:
+            document = self.documents.pop(gallery, None)
+            if document is None:
+                return
+            title_words, tags = document
+            for word in title_words:
+                galleries = self.title_postings[word]
+                galleries.discard(gallery)
+                if not galleries:
+                    self.title_postings.pop(word)
+                    self.title_words.remove(word)
+            for tag, namespace in tags:
+                namespaces = self.tag_postings[tag]
+                galleries = namespaces[namespace]
+                galleries.discard(gallery)
+                if not galleries:
+                    namespaces.pop(namespace)
+                if not namespaces:
+                    self.tag_postings.pop(tag)
+                    self.tags.remove(tag)
+
+    def find(self, term: str) -> Set['PandaViewer.gallery.GenericGallery']:
+        """
+        Returns every indexed gallery matched by a single search term.
+        """
+        term, namespace = Utils.separate_tag(term)
+        galleries = set()
+        with self.lock:
+            for word in self.title_words.find(term):
+                galleries |= self.title_postings[word]
+            for tag in self.tags.find(term):
+                namespaces = self.tag_postings[tag]
+                if namespace is None:
+                    for tag_galleries in namespaces.values():
+                        galleries |= tag_galleries
+                elif namespace in namespaces:
+                    galleries |= namespaces[namespace]
+        return galleries
+
+    def search(self, words: List[str], filters: List[str]) -> Set['PandaViewer.gallery.GenericGallery']:
+        """
+        Returns the indexed galleries matching all of words and none of filters.
+        """
+        with self.lock:
+            if words:
+                galleries = None
+                for word in sorted(words, key=len, reverse=True):  # Longer terms tend to be more selective
+                    matches = self.find(word)
+                    galleries = matches if galleries is None else galleries & matches
+                    if not galleries:
+                        return set()
+            else:
+                galleries = set(self.documents)
+            for word in filters:
+                galleries -= self.find(word)
+                if not galleries:
+                    break
+            return galleries
+
+
+class SearchQuery(Logger):
+    """
+    Parsed form of a search string.
+    Supports plain and quoted terms, "-" exclusions, namespace:tag terms and rating: comparisons,
+    e.g. 'artist:foo -"big bar" rating:>=4'.
+    Several comparisons can be given at once (rating:>2<4) and all of them must hold.
+    Queries are compiled once per search string and cached.
+    """
+
+    QUOTE_REGEX = re.compile(r"(-)?\"(.*?)\"")
+    FILTER_REGEX = re.compile(r"(?:^|\s)\-(.*?)(?=(?:$|\ ))")
+    RATING_REGEX = re.compile(r"rating:(\S*)")
+    COMPARISON_REGEX = re.compile(r"(==|=|!=|<=|>=|<|>)?(\d+(?:\.\d*)?|\.\d+)")
+    OPERATORS = {
+        None: operator.eq,
+        "=": operator.eq,
+        "==": operator.eq,
+        "!=": operator.ne,
+        "<=": operator.le,
+        ">=": operator.ge,
+        "<": operator.lt,
+        ">": operator.gt,
+    }
+
+    def __init__(self, words: List[str], filters: List[str], rating_comparisons: List[Tuple[Callable, float]]):
+        self.words = words
+        self.filters = filters
+        self.rating_comparisons = rating_comparisons
+
+    @classmethod
+    @functools.lru_cache(maxsize=128)
+    def compile(cls, search_text: str) -> 'SearchQuery':
+        search_text = search_text.lower()
+        rating_comparisons = []
+        rating_method = cls.RATING_REGEX.search(search_text)
+        if rating_method:
+            search_text = cls.RATING_REGEX.sub("", search_text)
+            rating_comparisons = cls.compile_rating(rating_method.groups()[0])
+        quoted_words = cls.QUOTE_REGEX.findall(search_text)
+        quoted_words = " ".join(map(lambda x: "".join(x).replace(" ", "_"), quoted_words))
+        search_text = cls.QUOTE_REGEX.sub("", search_text) + " " + quoted_words
+        filters = cls.FILTER_REGEX.findall(search_text)
+        words = cls.FILTER_REGEX.sub("", search_text).split()
+        return cls(words, filters, rating_comparisons)
+
+    @classmethod
+    def compile_rating(cls, rating_method: str) -> List[Tuple[Callable, float]]:
+        comparisons = []
+        position = 0
+        while position < len(rating_method):
+            match = cls.COMPARISON_REGEX.match(rating_method, position)
+            if not match:
+                raise exceptions.InvalidRatingSearch
+            comparisons.append((cls.OPERATORS[match.group(1)], float(match.group(2))))
+            position = match.end()
+        if not comparisons:
+            raise exceptions.InvalidRatingSearch
+        return comparisons
+
+    def matches_rating(self, gallery: 'PandaViewer.gallery.GenericGallery') -> bool:
+        if not self.rating_comparisons:
+            return True
+        rating = gallery.metadata_manager.get_value("rating")
+        if not rating:
+            return False
+        rating = float(rating)
+        return all(comparison(rating, value) for comparison, value in self.rating_comparisons)
+
+    def execute(self, index: SearchIndex,
+                galleries: List['PandaViewer.gallery.GenericGallery']) -> List['PandaViewer.gallery.GenericGallery']:
+        """
+        Returns the galleries matching this query, in the order they are given in.
+        """
+        matches = index.search(self.words, self.filters)
+        return [g for g in galleries if g in matches and self.matches_rating(g)]
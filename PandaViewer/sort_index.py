@@ -0,0 +1,111 @@
+from threading import RLock
+from itertools import count
+from collections import OrderedDict
+from bisect import bisect_left, insort_left
+from typing import Any, Dict, List, Tuple
+import PandaViewer
+from .logger import Logger
+
+
+class SortIndex(Logger):
+    """
+    Keeps every gallery presorted by each of the given sort keys.
+    Sort keys are computed once per gallery and cached until update is called, so switching the sort
+    method or reversing it is a single pass over the stored ordering and new galleries are inserted
+    with bisect instead of resorting everything.
+    Large batches (the startup load, early scan batches) are appended and sorted once instead, since
+    inserting them one at a time shifts the whole ordering for every gallery.
+    Galleries with equal keys keep the order they were added in.
+    """
+
+    # Batches are sorted in once they're at least this big and at least 1/BULK_RATIO of the index size
+    BULK_THRESHOLD = 64
+    BULK_RATIO = 32
+
+    def __init__(self, keys: List[str]):
+        self.lock = RLock()
+        self.keys = keys
+        self.counter = count()
+        self.orderings = {key: [] for key in keys}  # type: Dict[str, List[Tuple[Any, int, PandaViewer.gallery.GenericGallery]]]
+        self.gallery_keys = {}  # type: Dict[PandaViewer.gallery.GenericGallery, Tuple[int, Dict[str, Any]]]
+
+    def __len__(self) -> int:
+        return len(self.gallery_keys)
+
+    def __contains__(self, gallery: 'PandaViewer.gallery.GenericGallery') -> bool:
+        return gallery in self.gallery_keys
+
+    def get_sort_keys(self, gallery: 'PandaViewer.gallery.GenericGallery') -> Dict[str, Any]:
+        return {key: getattr(gallery, key) for key in self.keys}
+
+    def add(self, gallery: 'PandaViewer.gallery.GenericGallery'):
+        sort_keys = self.get_sort_keys(gallery)
+        with self.lock:
+            self._add(gallery, sort_keys)
+
+    def _add(self, gallery: 'PandaViewer.gallery.GenericGallery', sort_keys: Dict[str, Any]):
+        if gallery in self.gallery_keys:
+            self._set_keys(gallery, sort_keys)
+            return
+        order = next(self.counter)
+        self.gallery_keys[gallery] = (order, sort_keys)
+        for key, value in sort_keys.items():
+            insort_left(self.orderings[key], (value, order, gallery))
+
+    def add_all(self, galleries: List['PandaViewer.gallery.GenericGallery']):
+        entries = [(gallery, self.get_sort_keys(gallery)) for gallery in galleries]
+        with self.lock:
+            new_entries = OrderedDict()
+            for gallery, sort_keys in entries:
+                if gallery in self.gallery_keys:
+                    self._set_keys(gallery, sort_keys)
+                else:
+                    new_entries[gallery] = sort_keys
+            if len(new_entries) < self.BULK_THRESHOLD or len(new_entries) * self.BULK_RATIO < len(self.gallery_keys):
+                for gallery, sort_keys in new_entries.items():
+                    self._add(gallery, sort_keys)
+                return
+            for gallery, sort_keys in new_entries.items():
+                order = next(self.counter)
+                self.gallery_keys[gallery] = (order, sort_keys)
+                for key, value in sort_keys.items():
+                    self.orderings[key].append((value, order, gallery))
+            for ordering in self.orderings.values():
+                ordering.sort()
+
+    def remove(self, gallery: 'PandaViewer.gallery.GenericGallery'):
+        with self.lock:
+            order, sort_keys = self.gallery_keys.pop(gallery, (None, None))
+            if order is None:
+                return
+            for key, value in sort_keys.items():
+                self._remove_entry(key, value, order)
+
+    def update(self, gallery: 'PandaViewer.gallery.GenericGallery'):
+        """
+        Recomputes the sort keys of an indexed gallery after its metadata or location changed.
+        """
+        if gallery not in self.gallery_keys:
+            return
+        sort_keys = self.get_sort_keys(gallery)
+        with self.lock:
+            if gallery in self.gallery_keys:
+                self._set_keys(gallery, sort_keys)
+
+    def _set_keys(self, gallery: 'PandaViewer.gallery.GenericGallery', sort_keys: Dict[str, Any]):
+        order, old_sort_keys = self.gallery_keys[gallery]
+        for key, value in sort_keys.items():
+            old_value = old_sort_keys[key]
+            if value != old_value:
+                self._remove_entry(key, old_value, order)
+                insort_left(self.orderings[key], (value, order, gallery))
+        self.gallery_keys[gallery] = (order, sort_keys)
+
+    def _remove_entry(self, key: str, value: Any, order: int):
+        ordering = self.orderings[key]
+        ordering.pop(bisect_left(ordering, (value, order)))
+
+    def get_sorted(self, key: str, reverse: bool = False) -> List['PandaViewer.gallery.GenericGallery']:
+        with self.lock:
+            ordering = reversed(self.orderings[key]) if reverse else self.orderings[key]
+            return [gallery for _, _, gallery in ordering]
@@ -0,0 +1,114 @@
+import heapq
+from bisect import bisect_left, insort_left
+from threading import RLock
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+import PandaViewer
+from .utils import Utils
+from .logger import Logger
+
+
+class TagVocabulary(Logger):
+    """
+    Reference counted set of the tags used by galleries, kept in sorted order.
+    Namespaced tags also add their bare tag, so "artist:foo" adds both "artist:foo" and "foo".
+    Every update returns the entries that were added to or removed from the vocabulary,
+    so callers only need to apply those changes.
+    Also serves as the prefix completion engine for the search bar, ranking completions by how many
+    galleries use them.
+    """
+
+    MAX_CACHED_COMPLETIONS = 1024
+
+    def __init__(self):
+        self.lock = RLock()
+        self.counts = {}  # type: Dict[str, int]
+        self.entries = []  # type: List[str]
+        self.gallery_entries = {}  # type: Dict[PandaViewer.gallery.GenericGallery, FrozenSet[str]]
+        self.completions = {}  # type: Dict[Tuple[str, int], List[str]]
+
+    @staticmethod
+    def get_entries(gallery: 'PandaViewer.gallery.GenericGallery') -> FrozenSet[str]:
+        tags = {t.replace(" ", "_").lower() for t in gallery.metadata_manager.all_tags}
+        entries = set(tags)
+        for tag in tags:
+            raw_tag, namespace = Utils.separate_tag(tag)
+            if namespace:
+                entries.add(raw_tag)
+        return frozenset(entries)
+
+    def _set_entries(self, gallery: 'PandaViewer.gallery.GenericGallery',
+                     entries: FrozenSet[str]) -> Tuple[List[str], List[str]]:
+        old_entries = self.gallery_entries.get(gallery, frozenset())
+        if entries != old_entries:
+            self.completions.clear()
+        if entries:
+            self.gallery_entries[gallery] = entries
+        else:
+            self.gallery_entries.pop(gallery, None)
+        added = []
+        removed = []
+        for entry in entries - old_entries:
+            count = self.counts.get(entry, 0)
+            self.counts[entry] = count + 1
+            if not count:
+                insort_left(self.entries, entry)
+                added.append(entry)
+        for entry in old_entries - entries:
+            count = self.counts.pop(entry) - 1
+            if count:
+                self.counts[entry] = count
+            else:
+                self.entries.pop(bisect_left(self.entries, entry))
+                removed.append(entry)
+        return added, removed
+
+    def update(self, gallery: 'PandaViewer.gallery.GenericGallery') -> Tuple[List[str], List[str]]:
+        entries = self.get_entries(gallery)
+        with self.lock:
+            return self._set_entries(gallery, entries)
+
+    def remove(self, gallery: 'PandaViewer.gallery.GenericGallery') -> Tuple[List[str], List[str]]:
+        with self.lock:
+            return self._set_entries(gallery, frozenset())
+
+    def sync(self, galleries: Iterable['PandaViewer.gallery.GenericGallery']) -> Tuple[List[str], List[str]]:
+        """
+        Makes the vocabulary match exactly the given galleries.
+        :return: net added and removed entries
+        """
+        with self.lock:
+            old_entries = set(self.entries)
+            galleries = set(galleries)
+            for gallery in [g for g in self.gallery_entries if g not in galleries]:
+                self._set_entries(gallery, frozenset())
+            for gallery in galleries:
+                self._set_entries(gallery, self.get_entries(gallery))
+            new_entries = set(self.entries)
+        return list(new_entries - old_entries), list(old_entries - new_entries)
+
+    def complete(self, prefix: str, limit: int) -> List[str]:
+        """
+        Returns up to limit entries starting with prefix, most used first, then shortest first.
+        A leading "-" is kept on the results so exclusion terms complete like normal ones.
+        """
+        prefix = prefix.lower()
+        negated = prefix.startswith("-")
+        if negated:
+            prefix = prefix[1:]
+        key = (prefix, limit)
+        with self.lock:
+            completions = self.completions.get(key)
+            if completions is None:
+                start = bisect_left(self.entries, prefix)
+                end = bisect_left(self.entries, prefix + "\U0010ffff", start)
+                completions = heapq.nsmallest(limit, self.entries[start:end],
+                                              key=lambda e: (-self.counts[e], len(e), e))
+                if len(self.completions) >= self.MAX_CACHED_COMPLETIONS:
+                    self.completions.clear()
+                self.completions[key] = completions
+        if negated:
+            return ["-" + c for c in completions]
+        return completions
+
+    def __len__(self) -> int:
+        return len(self.entries)
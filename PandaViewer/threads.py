@@ -8,20 +8,26 @@ import time
 import copy
 import queue
 import threading
+import functools
+import multiprocessing
 from PyQt5 import QtCore
-from typing import List, Dict
+from typing import List, Dict, Iterable, Iterator, Tuple
 from collections import namedtuple
 from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import select, update
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import PandaViewer
-from .import metadata
+from .import metadata, thumbnails
 from .utils import Utils
 from .logger import Logger
 from .search import Search
 from .config import Config
 from PandaViewer import exceptions, ex_database, user_database
+from .hash_cache import hash_cache
+from .directory_snapshots import directory_snapshots
+from .directory_walker import DirectoryWalker
 from .request_managers import ex_request_manager
 from .gallery import GenericGallery, FolderGallery, ZipGallery, RarGallery, GalleryIDMap
 
@@ -81,16 +87,24 @@ class BaseThread(threading.Thread, Logger):
 
 class GalleryThread(BaseThread):
     running = False
-    existing_paths = None
+    QUEUE_SIZE = 1000
+    BATCH_SIZE = 200
+    BATCH_INTERVAL = .25
+    BATCH_END = object()
+    PATH_CHECK_THREADS = 16
+    PATH_CHECK_CHUNK_SIZE = 256
+    UPDATE_CHUNK_SIZE = 500
 
     def setup(self):
         super().setup()
         self.signals = self.Signals()
+        self.signals.batch.connect(PandaViewer.app.add_galleries)
         self.signals.end.connect(PandaViewer.app.find_galleries_done)
         self.signals.folder.connect(PandaViewer.app.set_scan_folder)
 
     class Signals(QtCore.QObject):
-        end = QtCore.pyqtSignal(list)
+        batch = QtCore.pyqtSignal(list)
+        end = QtCore.pyqtSignal()
         folder = QtCore.pyqtSignal(str)
 
     def _run(self):
@@ -98,8 +112,6 @@ class GalleryThread(BaseThread):
             self.running = False
             paths = self.queue.get()
             self.running = True
-            with PandaViewer.app.gallery_lock:
-                self.existing_paths = [g.location for g in PandaViewer.app.galleries if not g.expired]
             if paths is None:
                 self.load_all_galleries_from_db()
             else:
@@ -107,50 +119,68 @@ class GalleryThread(BaseThread):
 
     def load_all_galleries_from_db(self):
         self.logger.info("Starting to load galleries from database.")
-        candidates = []
         with user_database.get_session(self) as session:
             db_gallery_list = Utils.convert_result(session.execute(select([user_database.Gallery])).fetchall())
-            db_metadata_list = Utils.convert_result(session.execute(select([user_database.Metadata])).fetchall())
+            db_metadata_list = session.execute(select([user_database.Metadata])).fetchall()
         metadata_map = {}
         for metadata in db_metadata_list:
-            gallery_id = metadata["gallery_id"]
-            metadata_json = json.loads(metadata["json"])
-            metadata_json["id"] = metadata["id"]
-            metadata_json["name"] = metadata["name"]
-            if metadata_map.get(gallery_id):
-                metadata_map[gallery_id].append(metadata_json)
-            else:
-                metadata_map[gallery_id] = [metadata_json]
-        for gallery in db_gallery_list:
-            gallery["path"] = Utils.normalize_path(gallery["path"])
-            path_exists = os.path.exists(gallery["path"])
-            if not path_exists and not gallery["dead"]:
-                with user_database.get_session(self) as session:
-                    session.execute(
-                        update(user_database.Gallery).where(
-                            user_database.Gallery.id == gallery["id"]).values({"dead": True}))
+            metadata_map.setdefault(metadata["gallery_id"], []).append(metadata)
+        paths = [g["path"] for g in db_gallery_list]
+        with ThreadPoolExecutor(max_workers=self.PATH_CHECK_THREADS) as executor:
+            chunks = executor.map(self.check_paths, [paths[i:i + self.PATH_CHECK_CHUNK_SIZE]
+                                                     for i in range(0, len(paths), self.PATH_CHECK_CHUNK_SIZE)])
+            paths = [result for chunk in chunks for result in chunk]
+        died = []
+        revived = []
+        alive_galleries = []
+        for gallery, (path, path_exists) in zip(db_gallery_list, paths):
+            gallery["path"] = path
+            if not path_exists:
+                if not gallery["dead"]:
+                    died.append(gallery["id"])
                 continue
-            elif path_exists and gallery["dead"]:
-                with user_database.get_session(self) as session:
-                    session.execute(
-                        update(user_database.Gallery).where(
-                            user_database.Gallery.id == gallery["id"]).values({"dead": False}))
+            if gallery["dead"]:
+                revived.append(gallery["id"])
                 gallery["dead"] = False
-            elif gallery["dead"]:
-                continue
+            alive_galleries.append(gallery)
+        with user_database.get_session(self) as session:
+            for ids, dead in ((died, True), (revived, False)):
+                for i in range(0, len(ids), self.UPDATE_CHUNK_SIZE):
+                    session.execute(update(user_database.Gallery).where(
+                        user_database.Gallery.id.in_(ids[i:i + self.UPDATE_CHUNK_SIZE])).values({"dead": dead}))
+        self.logger.info("Done loading galleries from database: %s alive, %s newly dead, %s revived." %
+                         (len(alive_galleries), len(died), len(revived)))
+        self.create_from_dict(self.create_db_candidates(alive_galleries, metadata_map))
+
+    @staticmethod
+    def check_paths(paths: List[str]) -> List[Tuple[str, bool]]:
+        """
+        :return: normalized path and whether it exists, for each path
+        """
+        results = []
+        for path in paths:
+            path = Utils.normalize_path(path)
+            results.append((path, os.path.exists(path)))
+        return results
+
+    @staticmethod
+    def create_db_candidates(galleries: List[Dict], metadata_map: Dict[int, List]) -> Iterator[Dict]:
+        """
+        Metadata JSON is only decoded once the gallery's candidate is consumed by create_from_dict.
+        """
+        for gallery in galleries:
             gallery["metadata"] = {}
-            for metadata in metadata_map.get(gallery["id"], []):
-                name = metadata.pop("name")
-                gallery["metadata"][name] = metadata
-            candidate = {
+            for row in metadata_map.pop(gallery["id"], []):
+                metadata_json = json.loads(row["json"])
+                metadata_json["id"] = row["id"]
+                gallery["metadata"][row["name"]] = metadata_json
+            yield {
                 "path": gallery["path"],
                 "json": gallery,
                 "type": gallery["type"],
-                "loaded": True
+                "loaded": True,
+                "normalized": True,  # Already normalized by check_paths
             }
-            candidates.append(candidate)
-        self.logger.info("Done loading galleries from database.")
-        self.create_from_dict(candidates)
 
     def find_galleries(self, folders: List[str]):
         """
@@ -158,57 +188,62 @@ class GalleryThread(BaseThread):
         """
         folders = [f for f in folders if
                    not Utils.path_exists_under_directory(Utils.convert_from_relative_lsv_path(), f)]
-        candidates = []
+        incremental = Config.incremental_scan
         self.logger.debug("Starting search for new galleries.")
         self.logger.info("Scan folders: {FOLDERS}".format(FOLDERS=folders))
-        for folder in folders:
-            for base_folder, folders, files in os.walk(folder):
-                images = []
-                self.signals.folder.emit(base_folder)
-                for f in files:
-                    ext = os.path.splitext(f)[-1].lower()
-                    if ext in FolderGallery.IMAGE_EXTS:
-                        images.append(os.path.join(base_folder, f))
-                    elif ext in ZipGallery.ARCHIVE_EXTS + RarGallery.ARCHIVE_EXTS:
-                        archive_file = os.path.join(base_folder, f)
-                        if ext in ZipGallery.ARCHIVE_EXTS:
-                            type = GalleryIDMap.ZipGallery
-                        elif ext in RarGallery.ARCHIVE_EXTS:
-                            type = GalleryIDMap.RarGallery
-                        assert type
-                        candidates.append({"path": archive_file, "type": type.value,})
-                if images:
-                    candidates.append(
-                        {
-                            "path": base_folder,
-                            "type": GalleryIDMap.FolderGallery.value,
-                            "files": sorted(images, key=lambda f: f.lower())
-                        })
-        self.logger.info("Done with search for new galleries.")
-        self.create_from_dict(candidates)
-
-    def create_from_dict(self, candidates):
+        self.logger.info("Incremental scan: %s" % incremental)
+        walker = DirectoryWalker(incremental=incremental, on_directory=self.signals.folder.emit)
+        failed_directories = []
+        try:
+            self.create_from_dict(walker.walk(folders), failed_directories=failed_directories)
+            self.logger.info("Done with search for new galleries.")
+        finally:
+            # Also saved when some archives were invalid, otherwise one bad archive disables incremental rescans.
+            # Directories with a failed candidate are listed again next time, e.g. an archive still being copied.
+            snapshots = walker.snapshots
+            for directory in set(failed_directories):
+                snapshots.pop(directory, None)
+                directory_snapshots.invalidate(directory)
+            directory_snapshots.update(snapshots)
+
+    def create_from_dict(self, candidates: Iterable[Dict], failed_directories: List[str] = None):
+        """
+        Creates galleries from candidates.
+        Candidates can be streamed in, workers start creating galleries as soon as the first one arrives
+        and created galleries are sent to the UI in batches while the rest are still being created.
+        :param failed_directories: optional list the directories of candidates that failed are added to
+        """
         self.logger.info("Starting gallery creation from dicts.")
         galleries = []
         dead_galleries = []
         invalid_files = []
-        global_queue = queue.Queue()
-        for candidate in candidates:
-            candidate["path"] = Utils.normalize_path(candidate["path"])
-            if candidate["path"] not in self.existing_paths:
-                global_queue.put(candidate)
-                self.existing_paths.append(candidate["path"])
-
-        workers = self.generate_workers(global_queue, self.init_galleries)
+        global_queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        created_queue = queue.Queue()
+        batcher = threading.Thread(target=self.emit_batches, args=(created_queue,))
+        workers = self.generate_workers(global_queue, functools.partial(self.init_galleries,
+                                                                        created_queue=created_queue))
         self.logger.debug("Starting gallery workers")
+        batcher.start()
         for w in workers: w.thread.start()
-        for w in workers: w.thread.join()
+        try:
+            for candidate in candidates:
+                if not candidate.get("normalized"):
+                    candidate["path"] = Utils.normalize_path(candidate["path"])
+                if PandaViewer.app.path_index.reserve(candidate["path"]):
+                    global_queue.put(candidate)
+        finally:
+            for _ in workers: global_queue.put(None)
+            for w in workers: w.thread.join()
+            created_queue.put(self.BATCH_END)
+            batcher.join()
         self.logger.debug("Gallery workers done.")
         for worker in workers:
             galleries += worker.data.get_nowait()
             errors = worker.errors.get_nowait()
             dead_galleries += errors.dead_galleries
             invalid_files += errors.invalid_files
+            if failed_directories is not None:
+                failed_directories += errors.failed_directories
         if dead_galleries:
             with user_database.get_session(self) as session:
                 db_galleries = session.query(user_database.Gallery).filter(user_database.Gallery.id.in_(dead_galleries))
@@ -216,25 +251,54 @@ class GalleryThread(BaseThread):
                     db_gallery.dead = True
                     session.add(db_gallery)
         self.logger.debug("Done creating galleries from dicts.")
-        self.signals.end.emit(galleries)
+        hash_cache.flush()
+        hash_cache.log_stats()
+        self.signals.end.emit()
         if invalid_files:
             raise exceptions.UnknownArchiveErrorMessage(invalid_files)
         gallery_validator_thread.queue.put(galleries)
 
-    def init_galleries(self, global_queue, data_queue, error_queue):
+    def emit_batches(self, created_queue: queue.Queue):
+        """
+        Sends created galleries to the UI every BATCH_SIZE galleries or BATCH_INTERVAL seconds,
+        whichever comes first.
+        """
+        batch = []
+        deadline = time.time() + self.BATCH_INTERVAL
+        while True:
+            try:
+                gallery = created_queue.get(timeout=max(deadline - time.time(), 0))
+            except queue.Empty:
+                gallery = None
+            if gallery is self.BATCH_END:
+                break
+            if gallery is not None:
+                batch.append(gallery)
+            if len(batch) >= self.BATCH_SIZE or time.time() >= deadline:
+                if batch:
+                    self.signals.batch.emit(batch)
+                    batch = []
+                deadline = time.time() + self.BATCH_INTERVAL
+        if batch:
+            self.signals.batch.emit(batch)
+
+    def init_galleries(self, global_queue, data_queue, error_queue, created_queue=None):
         galleries = []
         invalid_files = []
         dead_galleries = []
+        failed_directories = []
 
-        errors = namedtuple("errors", "invalid_files dead_galleries")
-        while not global_queue.empty():
+        errors = namedtuple("errors", "invalid_files dead_galleries failed_directories")
+        while True:
+            candidate = global_queue.get()
+            if candidate is None:
+                break
             try:
-                candidate = global_queue.get_nowait()
                 self.signals.folder.emit(candidate["path"])
                 gallery_obj = GenericGallery.create_from_type(candidate["type"], candidate)
                 galleries.append(gallery_obj)
-            except queue.Empty:
-                break
+                if created_queue is not None:
+                    created_queue.put(gallery_obj)
             except exceptions.UnknownArchiveError:
                 gallery_obj = None
                 invalid_files.append(candidate["path"])
@@ -243,10 +307,16 @@ class GalleryThread(BaseThread):
             except Exception:
                 gallery_obj = None
                 self.logger.error("%s gallery got unhandled exception" % candidate, exc_info=True)
-            if candidate.get("loaded") and not gallery_obj:
-                dead_galleries.append(candidate["json"]["id"])
+            if not gallery_obj:
+                PandaViewer.app.path_index.release(candidate["path"])
+                if candidate["type"] == GalleryIDMap.FolderGallery.value:
+                    failed_directories.append(candidate["path"])
+                else:
+                    failed_directories.append(os.path.dirname(candidate["path"]))
+                if candidate.get("loaded"):
+                    dead_galleries.append(candidate["json"]["id"])
         data_queue.put(galleries)
-        error_queue.put(errors(invalid_files, dead_galleries))
+        error_queue.put(errors(invalid_files, dead_galleries, failed_directories))
 
 gallery_thread = GalleryThread()
 
@@ -278,12 +348,49 @@ folder_watcher_thread = FolderWatcherThread()
 
 
 class EventProcessorThread(BaseThread):
+    MAX_COALESCE_TIME = 10
 
     def _run(self):
         while True:
-            self.process_events(self.queue.get())
+            events = self.queue.get()
+            self.process_events(self.collect_events(events))
+
+    def collect_events(self, events: List) -> List:
+        """
+        Keeps collecting events until none arrive for Config.event_quiet_window seconds,
+        or until MAX_COALESCE_TIME seconds have passed.
+        """
+        quiet_window = Config.event_quiet_window
+        deadline = time.time() + self.MAX_COALESCE_TIME
+        while quiet_window > 0 and time.time() < deadline:
+            try:
+                events += self.queue.get(timeout=min(quiet_window, max(deadline - time.time(), 0)))
+            except queue.Empty:
+                break
+        return events
 
     def process_events(self, events):
+        """
+        Processes a batch of coalesced events.
+        Moves and deletions are applied in order, while refreshes are collected so that each affected
+        gallery is refreshed at most once and each affected folder is rescanned at most once.
+        """
+        self.logger.debug("Processing %s events" % len(events))
+        refresh_galleries = []
+        rescan_folders = set()
+
+        def refresh(gallery):
+            if gallery not in refresh_galleries:
+                refresh_galleries.append(gallery)
+
+        def file_created(path):
+            if Utils.file_has_allowed_extension(path, GenericGallery.IMAGE_EXTS):
+                gallery = PandaViewer.app.get_gallery_by_file(path)
+                if gallery:
+                    refresh(gallery)
+                    return
+            rescan_folders.add(os.path.dirname(path))
+
         for event in events:
             self.logger.debug(event)
             source = Utils.normalize_path(event.src_path)
@@ -293,57 +400,79 @@ class EventProcessorThread(BaseThread):
                 destination_folder = os.path.dirname(destination)
                 if event.is_directory:
                     with PandaViewer.app.gallery_lock:
-                        for gallery in PandaViewer.app.galleries:
-                            if Utils.path_exists_under_directory(source, gallery.folder):
-                                gallery.folder_moved(source, destination)
-                                if not any(Utils.path_exists_under_directory(d, gallery.folder)
-                                           for d in Config.folders):
-                                    PandaViewer.app.remove_gallery_and_recalculate_pages(gallery)
+                        for gallery in PandaViewer.app.path_index.galleries_under(source):
+                            gallery.folder_moved(source, destination)
+                            PandaViewer.app.update_gallery_location(gallery)
+                            if not Utils.ensure_trailing_sep(gallery.folder).startswith(Config.folder_prefixes):
+                                PandaViewer.app.remove_gallery_and_recalculate_pages(gallery)
                 else:
                     with PandaViewer.app.gallery_lock:
-                        gallery = next((g for g in PandaViewer.app.filter_galleries(PandaViewer.app.galleries)
-                                        if g.file_belongs_to_gallery(source)), None)
+                        gallery = PandaViewer.app.get_gallery_by_file(source)
                     if gallery:
                         if source_folder != destination_folder:
                             gallery.folder_moved(source_folder, destination_folder)
-                        gallery.file_moved(destination)
-                        if not any(Utils.path_exists_under_directory(d, gallery.folder) for d in Config.folders):
+                        gallery.file_moved(destination, refresh=False)
+                        PandaViewer.app.update_gallery_location(gallery)
+                        if not Utils.ensure_trailing_sep(gallery.folder).startswith(Config.folder_prefixes):
                             PandaViewer.app.remove_gallery_and_recalculate_pages(gallery)
+                        else:
+                            refresh(gallery)
+                    else:  # e.g. a temp file renamed to its final name once it's done being written
+                        file_created(destination)
             elif event.event_type == "deleted":
                 if event.is_directory:
                     with PandaViewer.app.gallery_lock:
-                        for gallery in PandaViewer.app.galleries:
-                            if Utils.path_exists_under_directory(source, gallery.folder):
-                                gallery.gallery_deleted()
-                                PandaViewer.app.remove_gallery_and_recalculate_pages(gallery, force_assertion=False)
+                        for gallery in PandaViewer.app.path_index.galleries_under(source):
+                            gallery.gallery_deleted()
+                            PandaViewer.app.remove_gallery_and_recalculate_pages(gallery, force_assertion=False)
                 else:
                     with PandaViewer.app.gallery_lock:
-                        gallery = next((g for g in PandaViewer.app.filter_galleries(PandaViewer.app.galleries)
-                                        if g.file_belongs_to_gallery(source)), None)
+                        gallery = PandaViewer.app.get_gallery_by_file(source)
                     if gallery:
-                        if gallery.file_deleted():
+                        if gallery.is_archive_gallery():
                             gallery.gallery_deleted()
                             PandaViewer.app.remove_gallery_and_recalculate_pages(gallery, force_assertion=False)
+                        else:
+                            refresh(gallery)
                     elif os.name == "nt":  # Windows doesn't have the is_directory flag set correctly for deleted events
                         with PandaViewer.app.gallery_lock:
-                            for gallery in PandaViewer.app.galleries:
-                                if Utils.path_exists_under_directory(source, gallery.folder):
-                                    gallery.gallery_deleted()
-                                    PandaViewer.app.remove_gallery_and_recalculate_pages(gallery, force_assertion=False)
+                            for gallery in PandaViewer.app.path_index.galleries_under(source):
+                                gallery.gallery_deleted()
+                                PandaViewer.app.remove_gallery_and_recalculate_pages(gallery, force_assertion=False)
             elif event.event_type == "created":
                 if event.is_directory:
-                    gallery_thread.queue.put([source_folder])
+                    rescan_folders.add(source_folder)
                 else:
-                    if Utils.file_has_allowed_extension(source, GenericGallery.IMAGE_EXTS):
-                        gallery = next((g for g in PandaViewer.app.filter_galleries(PandaViewer.app.galleries)
-                                        if g.file_belongs_to_gallery(source)), None)
-                        if gallery:
-                            gallery.reset_files()
-                            gallery.reset_filesystem_data()
-                        else:
-                            gallery_thread.queue.put([source_folder])
-                    else:
-                        gallery_thread.queue.put([source_folder])
+                    file_created(source)
+            elif event.event_type == "modified" and not event.is_directory:
+                with PandaViewer.app.gallery_lock:
+                    gallery = PandaViewer.app.get_gallery_by_file(source)
+                if gallery:
+                    refresh(gallery)
+
+        for gallery in refresh_galleries:
+            self.refresh_gallery(gallery)
+        if rescan_folders:
+            rescan_folders = [f for f in rescan_folders
+                              if not any(f != other and Utils.path_exists_under_directory(other, f)
+                                         for other in rescan_folders)]
+            self.logger.info("Rescanning folders: %s" % rescan_folders)
+            gallery_thread.queue.put(sorted(rescan_folders))
+
+    def refresh_gallery(self, gallery: GenericGallery):
+        if gallery.expired:
+            return
+        try:
+            with gallery.lock:
+                gallery.reset_files()
+                if not gallery.file_count:
+                    gallery.gallery_deleted()
+                else:
+                    gallery.reset_filesystem_data()
+            if gallery.expired:
+                PandaViewer.app.remove_gallery_and_recalculate_pages(gallery, force_assertion=False)
+        except Exception:
+            self.logger.warning("Failed to refresh %s" % gallery, exc_info=True)
 
 event_processor_thread = EventProcessorThread()
 
@@ -366,11 +495,26 @@ class GalleryValidatorThread(BaseThread):
 gallery_validator_thread = GalleryValidatorThread()
 
 
+class PrefetchThread(BaseThread):
+
+    def _run(self):
+        while True:
+            gallery, index = self.queue.get()  # type: Tuple[GenericGallery, int]
+            try:
+                gallery.prefetch_files(index)
+            except Exception:
+                self.logger.warning("Failed to prefetch files of %s" % gallery, exc_info=True)
+
+prefetch_thread = PrefetchThread()
+
+
 class ImageThread(BaseThread):
     WAIT = 2
     BG_GALLERY_COUNT = 25
     MAX_BG_RUNS = 20
+    PROCESS_BACKEND = "processes"
     bg_run_count = 0
+    process_pool = None
 
     def setup(self):
         super().setup()
@@ -390,7 +534,7 @@ class ImageThread(BaseThread):
             except queue.Empty:
                 pass
             if self.bg_run_count < self.MAX_BG_RUNS:
-                galleries = [g for g in PandaViewer.app.filter_galleries(PandaViewer.app.galleries)
+                galleries = [g for g in PandaViewer.app.visible_galleries
                              if not g.thumbnail_verified]
                 if galleries:
                     self.bg_run_count += 1
@@ -398,13 +542,17 @@ class ImageThread(BaseThread):
 
 
     def generate_images(self, galleries: List[GenericGallery], background: bool = False):
-        global_queue = queue.Queue()
-        for gallery in galleries:
-            if not gallery.expired and not gallery.thumbnail_verified:
+        galleries = [g for g in galleries if not g.expired and not g.thumbnail_verified]
+        if Config.thumbnail_backend == self.PROCESS_BACKEND:
+            self.generate_images_in_processes(galleries)
+        else:
+            global_queue = queue.Queue()
+            for gallery in galleries:
                 global_queue.put(gallery)
-        workers = self.generate_workers(global_queue, self.generate_image)
-        for w in workers: w.thread.start()
-        for w in workers: w.thread.join()
+            workers = self.generate_workers(global_queue, self.generate_image)
+            for w in workers: w.thread.start()
+            for w in workers: w.thread.join()
+        hash_cache.flush()
         if not background:
             self.signals.end.emit()
             thumbs = map(os.path.normcase,
@@ -434,6 +582,50 @@ class ImageThread(BaseThread):
             except Exception:
                 self.logger.error("%s failed to get image" % gallery, exc_info=True)
 
+    def get_process_pool(self) -> 'multiprocessing.pool.Pool':
+        if self.process_pool is None:
+            # Spawned rather than forked so workers don't inherit the Qt app or locks held by our other threads
+            self.process_pool = multiprocessing.get_context("spawn").Pool(
+                processes=os.cpu_count(), initializer=thumbnails.init_worker,
+                initargs=(QtCore.QCoreApplication.libraryPaths(),))
+        return self.process_pool
+
+    def generate_images_in_processes(self, galleries: List[GenericGallery]):
+        """
+        Same as load_thumbnail but the workers do the validation too: they hash the thumbnail source
+        and only generate a thumbnail if none exists for that hash, so a gallery whose hash didn't change
+        just gets marked as verified.
+        """
+        jobs = []
+        for gallery in galleries:
+            try:
+                with gallery.lock:
+                    gallery.thumbnail_source = gallery.thumbnail_source or str(0)
+                    jobs.append((gallery, gallery.get_thumbnail_job()))
+            except Exception:
+                self.logger.error("%s failed to get image" % gallery, exc_info=True)
+        results = self.get_process_pool().imap(thumbnails.generate_thumbnail, [job for _, job in jobs])
+        for (gallery, job), result in zip(jobs, results):
+            if result.error is not None:
+                self.logger.error("%s failed to get image\n%s" % (gallery, result.error))
+                continue
+            if result.size is not None and job.image_hash is None:
+                hash_cache.set_hash(job.path, result.image_hash, result.size, result.mtime_ns, member=job.member)
+            try:
+                with gallery.lock:
+                    if result.image_hash == gallery.image_hash:
+                        gallery.thumbnail_verified = True
+                        continue
+                    gallery.image_hash = result.image_hash
+                    gallery.save_metadata(update_ui=False)
+                    gallery.thumbnail_verified = True
+            except Exception:
+                self.logger.error("%s failed to save image" % gallery, exc_info=True)
+
+    def close(self):
+        if self.process_pool is not None:
+            self.process_pool.terminate()
+
 image_thread = ImageThread()
 
 
@@ -441,16 +633,21 @@ class SearchThread(BaseThread):
 
     class Signals(QtCore.QObject):
         gallery = QtCore.pyqtSignal(object, dict)
+        end = QtCore.pyqtSignal()
 
     def setup(self):
         super().setup()
         self.signals = self.Signals()
         self.signals.gallery.connect(PandaViewer.app.update_gallery_metadata)
+        self.signals.end.connect(PandaViewer.app.search_thread_done)
 
     def _run(self):
         while True:
             galleries = self.queue.get()
-            self.search(galleries)
+            try:
+                self.search(galleries)
+            finally:
+                self.signals.end.emit()
 
     def search(self, galleries: List[GenericGallery]):
         """
@@ -642,6 +839,8 @@ class DuplicateFinderThread(BaseThread):
                 duplicate_map[uuid].append(gallery)
             else:
                 duplicate_map[uuid] = [gallery]
+        hash_cache.flush()
+        hash_cache.log_stats()
         Utils.reduce_gallery_duplicates(duplicate_map)
         self.signals.end.emit()
 
@@ -654,6 +853,7 @@ DAEMON_THREADS = [
     ex_search_thread,
     duplicate_thread,
     gallery_validator_thread,
+    prefetch_thread,
     search_thread,
     folder_watcher_thread,
     event_processor_thread,
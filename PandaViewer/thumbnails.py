@@ -0,0 +1,99 @@
+import os
+import hashlib
+import traceback
+from collections import namedtuple
+from typing import List
+from unrar import rarfile
+from PyQt5 import QtCore, QtGui
+from . import zipfile
+
+
+THUMBNAIL_WIDTH = 200
+THUMBNAIL_HEIGHT = 280
+
+# Sources are a file on disk (member is "") or a member of a zip/rar archive (archive_format "zip"/"rar").
+# image_hash is passed along when it's already known so the worker doesn't have to hash the source again.
+ThumbnailJob = namedtuple("ThumbnailJob", "path member archive_format thumb_dir image_hash")
+# size and mtime_ns are the stat values of path the hash was generated for, None if it changed while hashing.
+ThumbnailResult = namedtuple("ThumbnailResult", "image_hash size mtime_ns error")
+
+
+def read_image(reader: QtGui.QImageReader, scale=None) -> QtGui.QImage:
+    """
+    :param scale: optional callable taking the size of the image and returning a smaller size to decode it at,
+    decoding at the smaller size lets formats like JPEG skip decoding the full resolution image
+    """
+    if scale is not None:
+        size = reader.size()
+        if size.isValid():
+            scaled_size = scale(size)
+            if scaled_size.width() < size.width() and scaled_size.height() < size.height():
+                reader.setScaledSize(scaled_size)
+    image = reader.read()
+    assert image.width()
+    return image
+
+
+def read_image_from_data(data: bytes, scale=None) -> QtGui.QImage:
+    buffer = QtCore.QBuffer()
+    buffer.setData(data)
+    buffer.open(QtCore.QIODevice.ReadOnly)
+    return read_image(QtGui.QImageReader(buffer), scale)
+
+
+def get_thumbnail_size(size: QtCore.QSize) -> QtCore.QSize:
+    """
+    Size an image has to be decoded at to cover the thumbnail, landscape images are rotated after decoding.
+    """
+    if size.width() > size.height():
+        return size.scaled(THUMBNAIL_HEIGHT, THUMBNAIL_WIDTH, QtCore.Qt.KeepAspectRatioByExpanding)
+    return size.scaled(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, QtCore.Qt.KeepAspectRatioByExpanding)
+
+
+def scale_thumbnail(image: QtGui.QImage) -> QtGui.QImage:
+    if image.width() > image.height():
+        transform = QtGui.QTransform()
+        transform.rotate(-90)
+        image = image.transformed(transform)
+    return image.scaled(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT,
+                        QtCore.Qt.KeepAspectRatioByExpanding, QtCore.Qt.SmoothTransformation)
+
+
+def read_job_source(job: ThumbnailJob) -> bytes:
+    if job.archive_format == "zip":
+        with zipfile.ZipFile(job.path, "r") as archive:
+            return archive.read(job.member)
+    elif job.archive_format == "rar":
+        return rarfile.RarFile(job.path, "r").read(job.member)
+    with open(job.path, "rb") as source:
+        return source.read()
+
+
+def init_worker(library_paths: List[str]):
+    """
+    Thumbnail process pool initializer, spawned workers don't go through the app setup that adds
+    the library paths Qt loads its image format plugins from.
+    """
+    QtCore.QCoreApplication.setLibraryPaths(library_paths)
+
+
+def generate_thumbnail(job: ThumbnailJob) -> ThumbnailResult:
+    """
+    Thumbnail process pool entry point, hashes the source of the job and saves its thumbnail to
+    <thumb_dir>/<hash>.jpg if it doesn't exist yet.
+    Only depends on Qt and the archive modules so it can run in a process without the app.
+    """
+    try:
+        stat = os.stat(job.path)
+        data = read_job_source(job)
+        image_hash = job.image_hash or hashlib.sha1(data).hexdigest()
+        thumbnail_path = os.path.join(job.thumb_dir, image_hash) + ".jpg"
+        if not os.path.exists(thumbnail_path):
+            image = scale_thumbnail(read_image_from_data(data, get_thumbnail_size))
+            assert image.save(thumbnail_path, "JPG")
+        new_stat = os.stat(job.path)
+        if (new_stat.st_size, new_stat.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            return ThumbnailResult(image_hash, None, None, None)
+        return ThumbnailResult(image_hash, stat.st_size, stat.st_mtime_ns, None)
+    except Exception:
+        return ThumbnailResult(None, None, None, traceback.format_exc())
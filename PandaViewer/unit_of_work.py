@@ -0,0 +1,70 @@
+from threading import RLock
+from collections import OrderedDict
+from typing import List
+import PandaViewer
+from PandaViewer import user_database
+from .logger import Logger
+
+
+class UnitOfWork(Logger):
+    """
+    Collects galleries whose metadata and gallery rows need to be saved and writes all of them
+    in a single transaction when flushed, instead of committing once per metadata entry.
+    Flushes on its own once FLUSH_THRESHOLD galleries are pending.
+    """
+
+    FLUSH_THRESHOLD = 200
+
+    def __init__(self):
+        self.lock = RLock()
+        self.galleries = OrderedDict()  # type: OrderedDict[PandaViewer.gallery.GenericGallery, None]
+
+    def add(self, gallery: 'PandaViewer.gallery.GenericGallery'):
+        with self.lock:
+            self.galleries[gallery] = None
+            need_flush = len(self.galleries) >= self.FLUSH_THRESHOLD
+        if need_flush:
+            self.flush()
+
+    def flush(self) -> List['PandaViewer.gallery.GenericGallery']:
+        """
+        If the batch fails to save, every gallery is saved again in its own transaction so one bad gallery
+        doesn't lose the others, galleries that still fail are queued again for the next flush.
+        :return: galleries that were saved
+        """
+        with self.lock:
+            galleries = [g for g in self.galleries if not g.expired]
+            self.galleries.clear()
+        if not galleries:
+            return galleries
+        self.logger.debug("Saving metadata of %s galleries." % len(galleries))
+        try:
+            self.save(galleries)
+        except Exception:
+            self.logger.warning("Failed to save metadata batch, saving galleries one at a time", exc_info=True)
+            failed = []
+            for gallery in galleries:
+                try:
+                    self.save([gallery])
+                except Exception:
+                    self.logger.error("Failed to save metadata of %s" % gallery, exc_info=True)
+                    failed.append(gallery)
+            with self.lock:
+                pending = self.galleries
+                self.galleries = OrderedDict.fromkeys(failed)
+                self.galleries.update(pending)
+            galleries = [g for g in galleries if g not in failed]
+        return galleries
+
+    def save(self, galleries: List['PandaViewer.gallery.GenericGallery']):
+        created = [m for g in galleries for m in g.metadata_manager.metadata.values() if m.db_id is None]
+        try:
+            with user_database.get_session(self, acquire=True) as session:
+                for gallery in galleries:
+                    gallery.save_metadata(update_ui=False, session=session)
+        except Exception:
+            for metadata in created:
+                metadata.db_id = None  # Its row was rolled back, it has to be inserted again
+            raise
+
+unit_of_work = UnitOfWork()
@@ -4,19 +4,43 @@ from migrate.versioning import api
 import contextlib
 from sqlalchemy.ext.declarative import declarative_base
 import os
-from threading import Lock
+import threading
+from collections import OrderedDict
 from PandaViewer.logger import Logger
 from PandaViewer.utils import Utils
+from PandaViewer import config
 
 DB_NAME = "db.sqlite"
 DATABASE_FILE = Utils.convert_from_relative_lsv_path(DB_NAME)
 DATABASE_URI = "sqlite:///" + DATABASE_FILE
 MIGRATE_REPO =  Utils.convert_from_relative_path("migrate_repo/")
 
+# PRAGMAs applied to every new connection, selected with config.Config.database_profile
+SQLITE_PROFILES = {
+    "performance": OrderedDict([
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("mmap_size", 256 * 1024 * 1024),
+        ("cache_size", -64 * 1024),  # Negative values are in KiB
+        ("temp_store", "MEMORY"),
+        ("busy_timeout", 30000),
+    ]),
+    "safe": OrderedDict([
+        ("journal_mode", "DELETE"),
+        ("synchronous", "FULL"),
+        ("busy_timeout", 30000),
+    ]),
+}
+POOL_SIZE = 8
+
 base = declarative_base()
-engine = sqlalchemy.create_engine(DATABASE_URI)
+# Connections are pooled and can be checked out by any thread, but each is only used by one thread at a time
+engine = sqlalchemy.create_engine(DATABASE_URI, poolclass=sqlalchemy.pool.QueuePool, pool_size=POOL_SIZE,
+                                  connect_args={"check_same_thread": False})
 session_maker = sqlalchemy.orm.sessionmaker(bind=engine)
-lock = Lock()
+session_registry = sqlalchemy.orm.scoped_session(session_maker)  # One session per thread
+session_state = threading.local()
+lock = threading.RLock()
 
 
 class UserDatabase(Logger):
@@ -35,6 +59,11 @@ class Config(base):
 
 class Gallery(base):
     __tablename__ = "gallery"
+    __table_args__ = (
+        sqlalchemy.Index("ix_gallery_uuid_type_dead", "uuid", "type", "dead"),
+        sqlalchemy.Index("ix_gallery_dead_image_hash", "dead", "image_hash"),
+        sqlalchemy.Index("ix_gallery_path", "path"),
+    )
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
     favorite = sqlalchemy.Column(sqlalchemy.Boolean)
     dead = sqlalchemy.Column(sqlalchemy.Boolean, default=False)
@@ -52,11 +81,49 @@ class Gallery(base):
 
 class Metadata(base):
     __tablename__ = "metadata"
+    __table_args__ = (
+        sqlalchemy.Index("ix_metadata_gallery_id", "gallery_id"),
+    )
     id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
     name = sqlalchemy.Column(sqlalchemy.Text, nullable=False)
     json = sqlalchemy.Column(sqlalchemy.Text)
     gallery_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("gallery.id"))
 
+
+class HashCache(base):
+    __tablename__ = "hash_cache"
+    __table_args__ = (
+        sqlalchemy.Index("ix_hash_cache_path_member", "path", "member", unique=True),
+    )
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    path = sqlalchemy.Column(sqlalchemy.Text, nullable=False)
+    member = sqlalchemy.Column(sqlalchemy.Text, default="", nullable=False)
+    size = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    mtime_ns = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    hash = sqlalchemy.Column(sqlalchemy.Text, nullable=False)
+
+
+class DirectorySnapshot(base):
+    __tablename__ = "directory_snapshot"
+    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+    path = sqlalchemy.Column(sqlalchemy.Text, nullable=False, unique=True)
+    mtime_ns = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    entry_count = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
+    digest = sqlalchemy.Column(sqlalchemy.Text, nullable=False)
+    subdirectories = sqlalchemy.Column(sqlalchemy.Text, default="[]", nullable=False)
+
+@sqlalchemy.event.listens_for(engine, "connect")
+def apply_profile(dbapi_connection, connection_record):
+    profile = SQLITE_PROFILES.get(config.Config.database_profile)
+    if profile is None:
+        Database.logger.warning("Unknown database profile %s, using performance" % config.Config.database_profile)
+        profile = SQLITE_PROFILES["performance"]
+    cursor = dbapi_connection.cursor()
+    for pragma, value in profile.items():
+        cursor.execute("PRAGMA %s = %s" % (pragma, value))
+    cursor.close()
+
+
 def setup():
     Database.logger.debug("Setting up database.")
     if not os.path.exists(DATABASE_FILE):
@@ -71,21 +138,32 @@ def setup():
 
 @contextlib.contextmanager
 def get_session(requester, acquire=False):
+    """
+    Yields the calling thread's session.
+    Nested calls on the same thread share the outermost session and transaction,
+    which is only committed (or rolled back) when the outermost call exits.
+    :param acquire: serialize with other writers holding the lock
+    """
     Database.logger.debug("New DB session requested from %s" % requester)
-    session = None
+    depth = getattr(session_state, "depth", 0)
+    if acquire:
+        lock.acquire()
+    session_state.depth = depth + 1
     try:
-        if acquire:
-            lock.acquire()
-        session = sqlalchemy.orm.scoped_session(session_maker)
+        session = session_registry()
         yield session
-        session.commit()
+        if not depth:
+            session.commit()
     except:
-        session.rollback()
+        if not depth:
+            session_registry().rollback()
         raise
     finally:
+        session_state.depth = depth
+        if not depth:
+            session_registry.remove()
         if acquire:
             lock.release()
-        session.close()
 
 if __name__ == "__main__":
     setup()
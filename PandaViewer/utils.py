@@ -9,6 +9,7 @@ from PandaViewer.logger import Logger
 
 class Utils(Logger):
     ensure_trailing_sep = lambda x: x if x[-1] == os.path.sep else x + os.path.sep
+    NAMESPACE_REGEX = re.compile("^(.*):(.*)$")
 
 
     @staticmethod
@@ -130,10 +131,9 @@ class Utils(Logger):
             key = functools.cmp_to_key(ctypes.windll.shlwapi.StrCmpLogicalW)
         return sorted(paths, key=key)
 
-    @staticmethod
-    def separate_tag(tag: str) -> (str, Optional[str]):
-        namespace_regex = re.compile("^(.*):(.*)$")
-        match = re.search(namespace_regex, tag)
+    @classmethod
+    def separate_tag(cls, tag: str) -> (str, Optional[str]):
+        match = cls.NAMESPACE_REGEX.search(tag)
         if match:
             return match.group(2), match.group(1)
         return tag, None
@@ -7,7 +7,7 @@ from . import flask_app, app
 def get_page(page_num):
     try:
         return jsonify({
-            "page": [g.get_json() for g in app.pages[page_num - 1]]
+            "page": [g.get_json() for g in app.get_page(page_num - 1)]
         })
     except IndexError:
         pass
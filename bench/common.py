@@ -0,0 +1,35 @@
+"""
+Helpers shared by the benchmark scripts.
+Run the scripts from the repository root, e.g. python bench/search.py
+"""
+import os
+import sys
+import time
+import types
+import importlib
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "PandaViewer")
+
+
+def import_module(name: str):
+    """
+    Imports PandaViewer.<name> without running PandaViewer/__init__.py, which starts the app.
+    """
+    if "PandaViewer" not in sys.modules:
+        package = types.ModuleType("PandaViewer")
+        package.__path__ = [PACKAGE_DIR]
+        sys.modules["PandaViewer"] = package
+    return importlib.import_module("PandaViewer." + name)
+
+
+def timed(function, repeat: int = 3) -> float:
+    """
+    :return: best wall time of repeat calls, in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
@@ -0,0 +1,104 @@
+"""
+Gallery creation throughput of the user database, 8 threads each creating galleries the way the
+gallery thread does: a gallery insert, two metadata inserts and a gallery update.
+Compares the old setup (default engine, a new session and commit per statement) with the
+SQLite profile, the connection pool and the per thread session of user_database.get_session.
+"""
+import os
+import sys
+import time
+import types
+import shutil
+import tempfile
+import threading
+import contextlib
+import sqlalchemy
+from common import import_module
+
+THREAD_COUNT = 8
+GALLERIES_PER_THREAD = 400
+
+config = types.ModuleType("PandaViewer.config")  # The real module writes settings.ini on import
+config.Config = types.SimpleNamespace(database_profile="performance")
+import_module("logger")
+sys.modules["PandaViewer.config"] = sys.modules["PandaViewer"].config = config
+user_database = import_module("user_database")
+
+
+@contextlib.contextmanager
+def old_get_session(session_maker, lock, acquire=False):
+    session = None
+    try:
+        if acquire:
+            lock.acquire()
+        session = sqlalchemy.orm.scoped_session(session_maker)
+        yield session
+        session.commit()
+    except:
+        session.rollback()
+        raise
+    finally:
+        if acquire:
+            lock.release()
+        session.close()
+
+
+def create_gallery(get_session, thread, i):
+    with get_session(acquire=True) as session:
+        gallery_id = session.execute(sqlalchemy.insert(user_database.Gallery).values(
+            {"path": "/library/%s/%s" % (thread, i), "type": 0, "uuid": "uuid"})).inserted_primary_key[0]
+    for name in ("gmetadata", "cmetadata"):
+        with get_session(acquire=True) as session:
+            session.execute(sqlalchemy.insert(user_database.Metadata).values(
+                {"name": name, "json": "{}", "gallery_id": gallery_id}))
+    with get_session(acquire=True) as session:
+        session.execute(sqlalchemy.update(user_database.Gallery).where(
+            user_database.Gallery.id == gallery_id).values({"read_count": 1}))
+
+
+def run(engine, get_session, batched=False) -> float:
+    """
+    :param batched: wrap each gallery in an outer session, nested get_session calls then share its transaction
+    :return: galleries created per second
+    """
+    user_database.base.metadata.create_all(engine)
+
+    def worker(thread):
+        for i in range(GALLERIES_PER_THREAD):
+            if batched:
+                with get_session(acquire=True):
+                    create_gallery(get_session, thread, i)
+            else:
+                create_gallery(get_session, thread, i)
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in range(THREAD_COUNT)]
+    start = time.perf_counter()
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    return THREAD_COUNT * GALLERIES_PER_THREAD / (time.perf_counter() - start)
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        old_engine = sqlalchemy.create_engine("sqlite:///" + os.path.join(directory, "old.sqlite"))
+        old_session_maker = sqlalchemy.orm.sessionmaker(bind=old_engine)
+        old_lock = threading.Lock()
+        print("old engine and sessions, commit per statement:  %6.0f galleries/s" %
+              run(old_engine, lambda acquire=False: old_get_session(old_session_maker, old_lock, acquire)))
+
+        engine = sqlalchemy.create_engine("sqlite:///" + os.path.join(directory, "new.sqlite"),
+                                          poolclass=sqlalchemy.pool.QueuePool, pool_size=user_database.POOL_SIZE,
+                                          connect_args={"check_same_thread": False})
+        sqlalchemy.event.listen(engine, "connect", user_database.apply_profile)
+        user_database.session_maker.configure(bind=engine)
+        get_session = lambda acquire=False: user_database.get_session("bench", acquire=acquire)
+        print("get_session, commit per statement:              %6.0f galleries/s" % run(engine, get_session))
+        print("get_session, one transaction per gallery:       %6.0f galleries/s" %
+              run(engine, get_session, batched=True))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark of the duplicate check done for every scan candidate, with 100k candidates of which
+half are already in the library.
+Compares the old existing_paths list with PathIndex.reserve.
+"""
+import os
+from common import import_module, timed
+
+CANDIDATE_COUNT = 100000
+
+path_index = import_module("path_index")
+
+
+class Gallery(object):
+
+    def __init__(self, location):
+        self.location = location
+        self.folder = os.path.dirname(location)
+
+
+def get_candidates():
+    return [os.path.join(os.sep, "library", "folder%06d" % i, "gallery") for i in range(CANDIDATE_COUNT)]
+
+
+def old_scan(galleries, candidates):
+    existing_paths = [g.location for g in galleries]
+    for path in candidates:
+        if path not in existing_paths:
+            existing_paths.append(path)
+
+
+def new_scan(galleries, candidates):
+    index = path_index.PathIndex()
+    for gallery in galleries:
+        index.add(gallery)
+    for path in candidates:
+        index.reserve(path)
+
+
+def main():
+    candidates = get_candidates()
+    galleries = [Gallery(path) for path in candidates[::2]]
+    print("%s candidates, %s existing galleries" % (len(candidates), len(galleries)))
+    print("existing_paths list: %.3fs" % timed(lambda: old_scan(galleries, candidates), repeat=1))
+    print("PathIndex:           %.3fs" % timed(lambda: new_scan(galleries, candidates)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Search and rating filter benchmark over a synthetic library of 100k galleries.
+Compares the old search, which re-parsed the query and ran eval() once per gallery, with
+SearchQuery.compile and SearchIndex.
+"""
+import re
+import random
+from common import import_module, timed
+
+GALLERY_COUNT = 100000
+QUERIES = [
+    "rating:>=4",
+    "rating:>2<4.5",
+    "artist:name12",
+    'female:tag3 -"male:tag7"',
+    "word42 rating:=5",
+    "-tag1",
+]
+
+Utils = import_module("utils").Utils
+exceptions = import_module("exceptions")
+search_index = import_module("search_index")
+
+
+class MetadataManager(object):
+
+    def __init__(self, rating, tags):
+        self.rating = rating
+        self.all_tags = tags
+
+    def get_value(self, key):
+        assert key == "rating"
+        return self.rating
+
+
+class Gallery(object):
+    expired = False
+
+    def __init__(self, title, rating, tags):
+        self.clean_name = title
+        self.metadata_manager = MetadataManager(rating, tags)
+
+
+def create_galleries():
+    rng = random.Random(0)
+    galleries = []
+    for i in range(GALLERY_COUNT):
+        title = " ".join("word%d" % rng.randrange(1000) for _ in range(5))
+        tags = ["artist:name%d" % rng.randrange(500)]
+        tags += ["%s:tag%d" % (rng.choice(["female", "male", "misc"]), rng.randrange(200)) for _ in range(8)]
+        galleries.append(Gallery(title, rng.choice([0, 1.5, 2.0, 3.5, 4.0, 4.5, 5.0]), tags))
+    return galleries
+
+
+def old_process_search(search_text):
+    search_text = search_text.lower()
+    quote_regex = re.compile(r"(-)?\"(.*?)\"")
+    filter_regex = re.compile(r"(?:^|\s)\-(.*?)(?=(?:$|\ ))")
+    rating_method = re.search(r"rating:(\S*)", search_text)
+    if rating_method:
+        search_text = re.sub(r"rating:\S*", "", search_text)
+        rating_method = rating_method.groups()[0]
+        if rating_method[0] == "=" and rating_method[1] != "=":
+            rating_method = "=" + rating_method
+        eval("0.0" + rating_method)
+    quoted_words = re.findall(quote_regex, search_text)
+    quoted_words = " ".join(map(lambda x: "".join(x).replace(" ", "_"), quoted_words))
+    search_text = re.sub(quote_regex, "", search_text) + quoted_words
+    filter_words = re.findall(filter_regex, search_text)
+    words = re.sub(filter_regex, "", search_text).split()
+    return words, filter_words, rating_method
+
+
+def old_in_search(tags, title, input_tag):
+    input_tag, namespace = Utils.separate_tag(input_tag)
+    for title_word in title:
+        if input_tag in title_word:
+            return True
+    for tag in tags:
+        tag, tag_namespace = Utils.separate_tag(tag)
+        if input_tag in tag and (namespace is None or tag_namespace == namespace):
+            return True
+    return False
+
+
+def old_search(galleries, search_text):
+    words, filters, rating_method = old_process_search(search_text)
+    results = []
+    for gallery in galleries:
+        title = gallery.clean_name.lower().split()
+        rating = gallery.metadata_manager.get_value("rating")
+        tags = [t.replace(" ", "_").lower() for t in gallery.metadata_manager.all_tags]
+        if rating_method and (not rating or not eval(str(rating) + rating_method)):
+            continue
+        if any(old_in_search(tags, title, w) for w in filters):
+            continue
+        if all(old_in_search(tags, title, w) for w in words) or len(words) == 0:
+            results.append(gallery)
+    return results
+
+
+def main():
+    galleries = create_galleries()
+    index = search_index.SearchIndex()
+    print("Indexing %s galleries: %.2fs" % (len(galleries), timed(lambda: [index.update(g) for g in galleries], 1)))
+    for query in QUERIES:
+        # The old parser can't read several comparisons, time it with the first one only
+        old_query = re.sub(r"(rating:[^\s<>=!]*[<>=!]+[\d.]+)[<>=!][\d.]+", r"\1", query)
+        compiled = search_index.SearchQuery.compile(query)
+        old_count = len(old_search(galleries, old_query))
+        new_count = len(compiled.execute(index, galleries))
+        old_time = timed(lambda: old_search(galleries, old_query))
+        new_time = timed(lambda: search_index.SearchQuery.compile(query).execute(index, galleries))
+        print("%-28s old %7.3fs (%6d results)  new %7.3fs (%6d results)" %
+              (query, old_time, old_count, new_time, new_count))
+    query = 'artist:name12 -"male:tag7" rating:>=4'
+    print("10000 cached compiles of %r: %.4fs" %
+          (query, timed(lambda: [search_index.SearchQuery.compile(query) for _ in range(10000)])))
+
+
+if __name__ == "__main__":
+    main()
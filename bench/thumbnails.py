@@ -0,0 +1,112 @@
+"""
+Thumbnail benchmark over large JPEG and PNG covers, measuring time per cover and peak RSS.
+Compares the old pipeline (full resolution decode, rotate, then scale) with decoding at thumbnail
+size through thumbnails.read_image.
+The covers are created and every run happens in its own process so peak RSS isn't carried over
+between them, Unix only.
+"""
+import os
+import sys
+import time
+import shutil
+import resource
+import tempfile
+import subprocess
+from common import import_module
+
+SIZES = [(6000, 9000), (9000, 6000)]  # Portrait and landscape covers
+COVERS_PER_FORMAT = {"jpg": 6, "png": 2}
+
+
+def get_covers(directory):
+    covers = {}
+    for extension, count in sorted(COVERS_PER_FORMAT.items()):
+        covers[extension] = [os.path.join(directory, "cover%s.%s" % (i, extension)) for i in range(count)]
+    return covers
+
+
+def create_covers(directory):
+    """
+    Child process entry point, saves the covers returned by get_covers.
+    """
+    from PyQt5 import QtGui
+    QtGui.QGuiApplication(sys.argv[:1])
+    for paths in get_covers(directory).values():
+        for i, path in enumerate(paths):
+            width, height = SIZES[i % len(SIZES)]
+            image = QtGui.QImage(width, height, QtGui.QImage.Format_RGB32)
+            painter = QtGui.QPainter(image)
+            gradient = QtGui.QLinearGradient(0, 0, width, height)
+            gradient.setColorAt(0, QtGui.QColor(200, 30, 30))
+            gradient.setColorAt(1, QtGui.QColor(30, 30, 200))
+            painter.fillRect(image.rect(), gradient)
+            painter.end()
+            assert image.save(path)
+
+
+def old_thumbnail(path):
+    from PyQt5 import QtCore, QtGui
+    thumbnails = import_module("thumbnails")
+    reader = QtGui.QImageReader()
+    reader.setDecideFormatFromContent(True)
+    reader.setFileName(path)
+    image = reader.read()
+    assert image.width()
+    if image.width() > image.height():
+        transform = QtGui.QTransform()
+        transform.rotate(-90)
+        image = image.transformed(transform)
+    return image.scaled(thumbnails.THUMBNAIL_WIDTH, thumbnails.THUMBNAIL_HEIGHT,
+                        QtCore.Qt.KeepAspectRatioByExpanding, QtCore.Qt.SmoothTransformation)
+
+
+def new_thumbnail(path):
+    from PyQt5 import QtGui
+    thumbnails = import_module("thumbnails")
+    reader = QtGui.QImageReader()
+    reader.setDecideFormatFromContent(True)
+    reader.setFileName(path)
+    return thumbnails.scale_thumbnail(thumbnails.read_image(reader, thumbnails.get_thumbnail_size))
+
+
+def run(mode, paths):
+    """
+    Child process entry point, prints milliseconds per cover and peak RSS in MB.
+    """
+    from PyQt5 import QtGui
+    QtGui.QGuiApplication(sys.argv[:1])
+    generate = old_thumbnail if mode == "old" else new_thumbnail
+    import_module("thumbnails")
+    start = time.perf_counter()
+    for path in paths:
+        image = generate(path)
+        assert (image.width(), image.height()) >= (200, 280)
+    elapsed = (time.perf_counter() - start) * 1000 / len(paths)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    print("%.0f %.0f" % (elapsed, peak))
+
+
+def run_child(*args) -> str:
+    return subprocess.check_output([sys.executable, os.path.abspath(__file__)] + list(args),
+                                   env=dict(os.environ, QT_QPA_PLATFORM="offscreen")).decode()
+
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        run_child("create", directory)
+        for extension, paths in get_covers(directory).items():
+            (old_time, old_peak), (new_time, new_peak) = [run_child(mode, *paths).split() for mode in ("old", "new")]
+            print("%s x%s: %s ms/cover, %s MB peak RSS -> %s ms/cover, %s MB peak RSS" %
+                  (extension.upper(), len(paths), old_time, old_peak, new_time, new_peak))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 1:
+        main()
+    elif sys.argv[1] == "create":
+        create_covers(sys.argv[2])
+    else:
+        run(sys.argv[1], sys.argv[2:])
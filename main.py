@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
 import sys
-from PandaViewer import app
+import multiprocessing
 
 
-sys.exit(app.exec_())
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    from PandaViewer import app
+    sys.exit(app.exec_())
@@ -0,0 +1,82 @@
+"""
+Regression test for the indexes on the hot gallery and metadata lookups.
+Builds the user database schema in an in-memory SQLite database and checks that none of the
+lookups fall back to a full table scan.
+"""
+import os
+import re
+import sys
+import types
+import importlib
+import pytest
+
+sqlalchemy = pytest.importorskip("sqlalchemy")
+pytest.importorskip("migrate")
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "PandaViewer")
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?(gallery|metadata)\b")
+
+
+@pytest.fixture(scope="module")
+def user_database():
+    """
+    Imports user_database without running PandaViewer/__init__.py, which starts the app,
+    and with a stand-in for the settings module, which writes settings.ini on import.
+    """
+    saved = {name: module for name, module in sys.modules.items() if name.split(".")[0] == "PandaViewer"}
+    for name in saved:
+        del sys.modules[name]
+    package = types.ModuleType("PandaViewer")
+    package.__path__ = [PACKAGE_DIR]
+    config = types.ModuleType("PandaViewer.config")
+    config.Config = types.SimpleNamespace(database_profile="performance")
+    package.config = config
+    sys.modules["PandaViewer"] = package
+    sys.modules["PandaViewer.config"] = config
+    try:
+        yield importlib.import_module("PandaViewer.user_database")
+    finally:
+        for name in [name for name in sys.modules if name.split(".")[0] == "PandaViewer"]:
+            del sys.modules[name]
+        sys.modules.update(saved)
+
+
+@pytest.fixture(scope="module")
+def engine(user_database):
+    engine = sqlalchemy.create_engine("sqlite://")
+    user_database.base.metadata.create_all(engine)
+    return engine
+
+
+def get_query_plan(engine, query):
+    compiled = query.compile(dialect=engine.dialect)
+    params = [compiled.params[name] for name in compiled.positiontup]
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("EXPLAIN QUERY PLAN " + str(compiled), params)
+        return [row[-1] for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+
+def get_queries(user_database):
+    Gallery = user_database.Gallery
+    Metadata = user_database.Metadata
+    return {
+        # GenericGallery.find_in_db
+        "find_in_db": sqlalchemy.select([Gallery]).where(
+            Gallery.uuid == "uuid").where(Gallery.type == 0).where(Gallery.dead == True),
+        # GenericGallery.load_from_db
+        "load_gallery": sqlalchemy.select([Gallery]).where(Gallery.id == 1),
+        "load_metadata": sqlalchemy.select([Metadata]).where(Metadata.gallery_id == 1),
+        # ImageThread.generate_images
+        "alive_hashes": sqlalchemy.select([Gallery.image_hash]).where(Gallery.dead == False),
+    }
+
+
+@pytest.mark.parametrize("name", ["find_in_db", "load_gallery", "load_metadata", "alive_hashes"])
+def test_query_uses_index(user_database, engine, name):
+    plan = get_query_plan(engine, get_queries(user_database)[name])
+    assert plan
+    assert not [step for step in plan if FULL_SCAN.match(step)], plan